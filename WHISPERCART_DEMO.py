@@ -4,6 +4,8 @@ WHISPERCART - The Simplest Working Demo
 Just run this and see your AI shopping assistant in action!
 """
 
+from intent_engine import analyze_intent
+
 print("🛒 WELCOME TO WHISPERCART!")
 print("🤖 Your AI Shopping Assistant")
 print("=" * 50)
@@ -42,27 +44,7 @@ def ai_analyze_request(text):
     print(f"\n🎤 You said: '{text}'")
     print("🤖 AI processing...")
 
-    text = text.lower()
-    category = 'running shoes'  # default
-    budget = 3000  # default
-
-    # Detect category
-    if 'headphone' in text:
-        category = 'headphones'
-    elif 'smartphone' in text or 'phone' in text:
-        category = 'smartphones'
-    elif 'laptop' in text:
-        category = 'laptops'
-    elif 'watch' in text:
-        category = 'watches'
-    elif 'shoe' in text:
-        category = 'running shoes'
-
-    # Extract budget
-    import re
-    numbers = re.findall(r'\d+', text)
-    if numbers:
-        budget = int(numbers[0])
+    category, budget, _ = analyze_intent(text)
 
     print(f"🎯 AI understood: {category} under ₹{budget}")
     return category, budget
@@ -1,78 +1,369 @@
-import nltk
-nltk.download('punkt')
+import time
+_IMPORT_STARTED = time.perf_counter()
 
+# The Punkt splitter below runs with empty PunktParameters, so no NLTK data
+# download is needed (and none is attempted) at import.
 from nltk.tokenize import TreebankWordTokenizer
 from nltk.tokenize.punkt import PunktParameters, PunktSentenceTokenizer
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import argparse
+import base64
+import csv
+import io
+import os
+import statistics
+import subprocess
+import sys
 import re
-import sqlite3
 import json
+import sqlite3
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from operator import itemgetter
 from rapidfuzz import fuzz
+from query_log import QueryLogWriter
+from archive import ArchiveReader, archive_old_partitions, enable_incremental_vacuum, reclaim_space
+from payloads import canonical_json, database_bytes, decode_payload, store_payloads
+from db import MIGRATIONS, ConnectionManager, insert_query_terms, migrate, rebuild_rollups
+from result_cache import ResultCache
+from matcher import Match
+from metrics import MetricsRegistry
+from tokenizer import SpanTokenizer
+from vocabulary import VocabularyStore, load_or_compile, read_vocabulary_source, save_artifact
+
+# Import-time stage durations in seconds (see --startup-time)
+STARTUP_TIMINGS = {"imports": time.perf_counter() - _IMPORT_STARTED}
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# =========================
+# Metrics (Prometheus text format at /metrics)
+# =========================
+# METRICS_ENABLED=0 turns instrumentation off entirely: timed functions are
+# left unwrapped, no request hooks are installed and /metrics is not served.
+METRICS = MetricsRegistry(enabled=os.getenv("METRICS_ENABLED", "1") != "0")
+
+REQUESTS = METRICS.counter(
+    "whispercart_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+REQUEST_SECONDS = METRICS.histogram(
+    "whispercart_request_seconds", "HTTP request latency by endpoint.", ("endpoint",))
+STAGE_SECONDS = METRICS.histogram(
+    "whispercart_stage_seconds", "Time spent in each extraction pipeline stage per call.", ("stage",))
+DB_WRITE_SECONDS = METRICS.histogram(
+    "whispercart_db_write_seconds", "Query log insert latency (one row or one batch).", ("mode",))
+MATCHES = METRICS.counter(
+    "whispercart_matches_total", "Matches attached to returned products, by type.", ("type",))
+PRODUCTS_PER_RESPONSE = METRICS.histogram(
+    "whispercart_products_per_response", "Products in each extraction response.",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+METRICS.collector(
+    "whispercart_result_cache_events_total", "Result cache lookups and removals.", "counter",
+    lambda: {(event,): value for event, value in RESULT_CACHE.stats().items()
+             if event in ("hits", "misses", "coalesced", "evictions", "expirations")},
+    ("event",))
+METRICS.collector(
+    "whispercart_result_cache_entries", "Entries in the result cache.", "gauge",
+    lambda: {(): RESULT_CACHE.stats()["size"]})
+METRICS.collector(
+    "whispercart_query_log_rows_total", "Query log rows by outcome.", "counter",
+    lambda: {(outcome,): value for outcome, value in QUERY_LOG.stats().items()
+             if outcome in ("enqueued", "written", "dropped", "spilled")},
+    ("outcome",))
+METRICS.collector(
+    "whispercart_query_log_queue_depth", "Rows waiting for the query log writer.", "gauge",
+    lambda: {(): QUERY_LOG.stats()["queue_depth"]})
+METRICS.collector(
+    "whispercart_match_pairs_total",
+    "Window/phrase pairs: considered by a full scan vs scored after the q-gram index.", "counter",
+    lambda: {(kind,): value for kind, value in VOCABULARY.current.index.stats().items()
+             if kind in ("considered", "scored")},
+    ("kind",))
+
+def record_response(result):
+    """Products-per-response and per-type match counts for one extraction result."""
+    PRODUCTS_PER_RESPONSE.observe(result["total_products"])
+    MATCHES.inc(result["total_products"], ("product",))
+    for field, kind in (("brands", "brand"), ("colors", "color"),
+                        ("quantities", "quantity"), ("budgets", "budget")):
+        MATCHES.inc(sum(len(p[field]) for p in result["products"]), (kind,))
+
+if METRICS.enabled:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or "unmatched"
+        REQUESTS.inc(labels=(endpoint, str(response.status_code)))
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, (endpoint,))
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # =========================
 # Database Configuration
 # =========================
 DATABASE_PATH = 'whispercart.db'
 
+# One persistent, WAL-mode connection per thread (see db.py). The first
+# connection of each process migrates the schema, so `flask run`, other
+# WSGI servers and importers get the same tables as `python app.py`.
+DB = ConnectionManager(DATABASE_PATH, migrations=MIGRATIONS)
+
 def init_database():
-    """Initialize the database and create tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS queries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            raw_text TEXT NOT NULL,
-            extracted_json TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Bring the schema up to date now rather than on the first query."""
+    migrate(DB.connection())
+
+# Result payloads are shared between identical results (see payloads.py);
+# QUERY_PAYLOAD_COMPRESSION=0 stores them as plain compact JSON
+QUERY_PAYLOAD_COMPRESSION = os.getenv("QUERY_PAYLOAD_COMPRESSION", "1") != "0"
+
+def insert_queries(conn, rows):
+    """Insert (raw_text, extracted_json) rows inside the caller's transaction."""
+    documents = [canonical_json(extracted_json) for _, extracted_json in rows]
+    payload_ids = store_payloads(conn, documents, QUERY_PAYLOAD_COMPRESSION)
+    conn.executemany(
+        "INSERT INTO queries (raw_text, payload_id) VALUES (?, ?)",
+        [(raw_text, payload_id) for (raw_text, _), payload_id in zip(rows, payload_ids)],
+    )
+    # The transaction holds the write lock, so AUTOINCREMENT gave the rows
+    # consecutive ids ending at the last one inserted
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    inserted = conn.execute(
+        "SELECT id, created_at FROM queries WHERE id BETWEEN ? AND ? ORDER BY id",
+        (last_id - len(rows) + 1, last_id),
+    ).fetchall()
+    # The side tables' trigger only sees inline JSON
+    insert_query_terms(conn, [
+        (query_id, created_at, extracted_json)
+        for (query_id, created_at), (_, extracted_json) in zip(inserted, rows)
+    ])
 
+@METRICS.timed(DB_WRITE_SECONDS, ("single",))
 def save_query(raw_text, extracted_json):
     """Save a query and its extracted JSON to the database."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO queries (raw_text, extracted_json)
-        VALUES (?, ?)
-    ''', (raw_text, json.dumps(extracted_json)))
-    
-    conn.commit()
-    conn.close()
-
-def get_recent_queries(limit=10):
-    """Get the most recent queries from the database."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, raw_text, extracted_json, created_at
-        FROM queries
-        ORDER BY created_at DESC
+    conn = DB.connection()
+
+    with conn:
+        insert_queries(conn, [(raw_text, extracted_json)])
+
+@METRICS.timed(DB_WRITE_SECONDS, ("batch",))
+def save_queries(rows):
+    """Save many (raw_text, extracted_json) pairs in a single transaction."""
+    if not rows:
+        return
+    conn = DB.connection()
+
+    with conn:
+        insert_queries(conn, rows)
+
+# Write-behind logger: /extract queues rows and a background thread
+# persists them in batches through save_queries()
+QUERY_LOG = QueryLogWriter(
+    save_queries,
+    max_queue=int(os.getenv("QUERY_LOG_MAX_QUEUE", "10000")),
+    batch_size=int(os.getenv("QUERY_LOG_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "0.5")),
+    overflow=os.getenv("QUERY_LOG_OVERFLOW", "block"),
+    spill_path=os.getenv("QUERY_LOG_SPILL_PATH", "query_log_spill.jsonl"),
+).register_atexit()
+
+# Retention (see archive.py): partitions (calendar months, or days) of the
+# query log older than QUERY_RETENTION_DAYS move to compressed files in
+# QUERY_ARCHIVE_DIR when `python app.py --archive` runs; /history?archived=1
+# reads them back
+QUERY_ARCHIVE_DIR = os.getenv("QUERY_ARCHIVE_DIR", "query_archive")
+QUERY_RETENTION_DAYS = int(os.getenv("QUERY_RETENTION_DAYS", "90"))
+QUERY_ARCHIVE_PARTITION = os.getenv("QUERY_ARCHIVE_PARTITION", "month")
+
+ARCHIVES = ArchiveReader(QUERY_ARCHIVE_DIR)
+
+def archive_query_log(now=None, log=print):
+    """Archive the partitions that ended more than QUERY_RETENTION_DAYS ago."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = (now - timedelta(days=QUERY_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    return archive_old_partitions(DB.connection(), QUERY_ARCHIVE_DIR, cutoff, QUERY_ARCHIVE_PARTITION, log)
+
+# Side table (see db.py migration 4) behind each /history term filter
+HISTORY_TERM_TABLES = {"product": "query_products", "brand": "query_brands", "color": "query_colors"}
+
+HISTORY_MAX_LIMIT = 100
+
+def encode_history_cursor(created_at, query_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, query_id]).encode()).decode()
+
+def decode_history_cursor(cursor):
+    """(created_at, id) of a cursor from encode_history_cursor(); ValueError if malformed."""
+    try:
+        created_at, query_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(query_id, int):
+        raise ValueError("invalid cursor")
+    return created_at, query_id
+
+def history_timestamp(value):
+    """An ISO 8601 date/time as a UTC created_at string; ValueError if malformed."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def fts_phrase_query(text):
+    """Every word of ``text`` as a quoted FTS5 term, so user input is never FTS syntax."""
+    # A NUL would end the query string early inside FTS5
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.replace("\x00", " ").split())
+
+def history_entry(row):
+    """/history dict of an (id, raw_text, extracted_json, created_at) row;
+    live rows add the (encoding, body) of their payload."""
+    return {
+        'id': row[0],
+        'raw_text': row[1],
+        'extracted_json': json.loads(row[2]) if row[2] is not None else decode_payload(row[4], row[5]),
+        'created_at': row[3]
+    }
+
+def get_recent_queries(limit=10, cursor=None, product=None, brand=None, color=None,
+                       since=None, until=None, text=None):
+    """The newest queries matching every given filter, and the cursor for the next page.
+
+    ``product``/``brand``/``color`` match the normalized names of the
+    extraction, ``since``/``until`` bound created_at (UTC, until
+    exclusive) and ``text`` must match every word of raw_text. Pages are
+    ordered by (created_at, id) descending; ``cursor`` continues after the
+    last row of the previous page. The first term filter drives the query
+    through its (term, created_at, query_id) index, the others are primary
+    key probes, and without one it walks idx_queries_created_at. A ``text``
+    filter looks its rows up in queries_fts and sorts just those.
+    """
+    conn = DB.connection()
+
+    terms = [(HISTORY_TERM_TABLES[name], name, value.lower())
+             for name, value in (("product", product), ("brand", brand), ("color", color)) if value]
+    if terms:
+        table, column, value = terms.pop(0)
+        source = f"{table} AS d JOIN queries AS q ON q.id = d.query_id"
+        created_at, query_id = "d.created_at", "d.query_id"
+        where, params = [f"d.{column} = ?"], [value]
+    else:
+        source = "queries AS q"
+        created_at, query_id = "q.created_at", "q.id"
+        where, params = [], []
+    for table, column, value in terms:
+        where.append(f"EXISTS (SELECT 1 FROM {table} AS t WHERE t.query_id = q.id AND t.{column} = ?)")
+        params.append(value)
+    if since:
+        where.append(f"{created_at} >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{created_at} < ?")
+        params.append(until)
+    if text:
+        where.append("q.id IN (SELECT rowid FROM queries_fts WHERE queries_fts MATCH ?)")
+        params.append(fts_phrase_query(text))
+    if cursor:
+        where.append(f"({created_at}, {query_id}) < (?, ?)")
+        params.extend(cursor)
+
+    rows = conn.execute(f'''
+        SELECT q.id, q.raw_text, q.extracted_json, q.created_at, p.encoding, p.body
+        FROM {source} LEFT JOIN payloads AS p ON p.id = q.payload_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {created_at} DESC, {query_id} DESC
         LIMIT ?
-    ''', (limit,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    queries = []
-    for row in rows:
-        queries.append({
-            'id': row[0],
-            'raw_text': row[1],
-            'extracted_json': json.loads(row[2]),
-            'created_at': row[3]
-        })
-    
-    return queries
+    ''', params + [limit + 1]).fetchall()
+
+    queries = [history_entry(row) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_history_cursor(queries[-1]['created_at'], queries[-1]['id'])
+    return queries, next_cursor
+
+# Rollup dimensions served by /stats (see db.py migration 5)
+STATS_DIMENSIONS = ("product", "brand", "color", "budget")
+STATS_MAX_TOP = 100
+STATS_MAX_SERIES_BUCKETS = 24 * 31
+
+def hour_floor(timestamp):
+    return timestamp[:13] + ":00:00"
+
+def rollup_ranges(since, until):
+    """(granularity, first bucket, end bucket) ranges covering [since, until)
+    truncated to hours: day rollups for the whole days, hour rollups for
+    the partial days at either end."""
+    since, until = hour_floor(since), hour_floor(until)
+    first_day = since[:10] if since.endswith("00:00:00") else (
+        (datetime.fromisoformat(since[:10]) + timedelta(days=1)).strftime("%Y-%m-%d"))
+    last_day = until[:10]
+    if first_day >= last_day:
+        return [("hour", since, until)]
+    return [
+        ("hour", since, first_day + " 00:00:00"),
+        ("day", first_day, last_day),
+        ("hour", last_day + " 00:00:00", until),
+    ]
+
+def get_stats(since, until, top=10):
+    """Query count and the ``top`` values of each dimension for [since, until).
+
+    Reads at most two partial days of hour buckets plus one day bucket per
+    whole day, whatever the traffic.
+    """
+    conn = DB.connection()
+    ranges = rollup_ranges(since, until)
+    branches = " UNION ALL ".join(
+        "SELECT value, count FROM rollups WHERE dimension = ? AND granularity = ? AND bucket >= ? AND bucket < ?"
+        for _ in ranges
+    )
+
+    def totals(dimension, limit):
+        params = [p for granularity, start, end in ranges for p in (dimension, granularity, start, end)]
+        return conn.execute(f'''
+            SELECT value, SUM(count) AS total FROM ({branches})
+            GROUP BY value ORDER BY total DESC, value LIMIT ?
+        ''', params + [limit]).fetchall()
+
+    queries = totals("queries", 1)
+    return {
+        "since": hour_floor(since),
+        "until": hour_floor(until),
+        "queries": queries[0][1] if queries else 0,
+        "top": {
+            dimension: [{"value": value, "count": count} for value, count in totals(dimension, top)]
+            for dimension in STATS_DIMENSIONS
+        },
+    }
+
+def get_stats_series(since, until, granularity, top=10):
+    """Per-bucket query count and top values, from the ``granularity`` rollups."""
+    conn = DB.connection()
+    if granularity == "day":
+        start, end = since[:10], until[:10]
+    else:
+        start, end = hour_floor(since), hour_floor(until)
+    buckets = {}
+    for dimension in ("queries",) + STATS_DIMENSIONS:
+        rows = conn.execute('''
+            SELECT bucket, value, count FROM rollups
+            WHERE dimension = ? AND granularity = ? AND bucket >= ? AND bucket < ?
+            ORDER BY bucket, count DESC, value
+        ''', (dimension, granularity, start, end))
+        for bucket, value, count in rows:
+            entry = buckets.setdefault(bucket, {"bucket": bucket, "queries": 0, "top": {d: [] for d in STATS_DIMENSIONS}})
+            if dimension == "queries":
+                entry["queries"] = count
+            elif len(entry["top"][dimension]) < top:
+                entry["top"][dimension].append({"value": value, "count": count})
+    return [buckets[b] for b in sorted(buckets)]
 
 # =========================
 # Keywords (extend as needed)
@@ -149,19 +440,139 @@ BUDGET_PROXIMITY              = 5
 FUZZY_PRODUCT_MERGE_WINDOW    = 6
 FUZZY_PRODUCT_MERGE_THRESHOLD = 85   # stricter than before
 
+MAX_BATCH_SIZE                = 1000  # texts per /extract/batch request
+STREAM_BATCH_SIZE             = 64    # records matched together by /extract/stream
+
+# Longer token lists are extracted window by window (see iter_products_windowed)
+EXTRACT_WINDOW_TOKENS = int(os.getenv("EXTRACT_WINDOW_TOKENS", "512"))
+# Longest accepted text, in characters; /extract answers 413 above it
+MAX_TEXT_CHARS = int(os.getenv("MAX_TEXT_CHARS", "200000"))
+
 # =========================
 # Tokenizers
 # =========================
-punkt_param = PunktParameters()
-sentence_splitter = PunktSentenceTokenizer(punkt_param)
-word_tokenizer = TreebankWordTokenizer()
+# "regex": single-pass tokenizer (tokenizer.py), identical output to Punkt +
+# Treebank; "punkt": always run Punkt + Treebank.
+TOKENIZER = os.getenv("TOKENIZER", "regex")
+
+def make_tokenizers():
+    """(sentence splitter, word tokenizer) used by my_word_tokenize."""
+    punkt_param = PunktParameters()
+    return PunktSentenceTokenizer(punkt_param), TreebankWordTokenizer()
 
+@METRICS.timed(STAGE_SECONDS, ("tokenize",))
 def my_word_tokenize(text):
-    sentences = sentence_splitter.tokenize(text)
-    tokens = []
-    for sent in sentences:
-        tokens.extend(word_tokenizer.tokenize(sent))
-    return tokens
+    return span_tokenizer.tokenize(text)
+
+def my_word_spans(text):
+    """(token, start_char, end_char) for every token of my_word_tokenize(text)."""
+    return span_tokenizer.span_tokenize(text)
+
+# =========================
+# Result cache
+# =========================
+# Keys carry the vocabulary version, so results computed against other
+# keyword lists are never served; the cache is also cleared on every swap.
+RESULT_CACHE = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "300")),
+)
+# Longer texts bypass the cache; their entries would crowd out the rest
+RESULT_CACHE_MAX_CHARS = int(os.getenv("RESULT_CACHE_MAX_CHARS", "4096"))
+
+# =========================
+# Precompiled vocabulary (loaded from the artifact when current)
+# =========================
+# Build with `python app.py --build-artifact`; a missing or stale artifact
+# (different keyword lists, threshold or format) falls back to compiling.
+VOCABULARY_ARTIFACT_PATH = os.getenv(
+    "VOCABULARY_ARTIFACT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocabulary.artifact"),
+)
+
+# Optional runtime vocabulary: "file:<path.json>" or "sqlite:<path.db>"
+# (see vocabulary.py). When set, it replaces the keyword lists above and is
+# polled every VOCABULARY_POLL_INTERVAL seconds for changes.
+VOCABULARY_SOURCE = os.getenv("VOCABULARY_SOURCE", "")
+VOCABULARY_POLL_INTERVAL = float(os.getenv("VOCABULARY_POLL_INTERVAL", "5"))
+
+_stage_started = time.perf_counter()
+if VOCABULARY_SOURCE:
+    _keywords = read_vocabulary_source(VOCABULARY_SOURCE)
+else:
+    _keywords = (PRODUCT_KEYWORDS, BRAND_KEYWORDS, COLOR_KEYWORDS, SHADE_TO_ROOT)
+_vocab, VOCAB_SOURCE = load_or_compile(VOCABULARY_ARTIFACT_PATH, *_keywords, FUZZY_THRESHOLD, make_tokenizers)
+STARTUP_TIMINGS["vocabulary"] = time.perf_counter() - _stage_started
+
+# Requests read VOCABULARY.current once and use that snapshot throughout
+VOCABULARY = VocabularyStore(
+    _vocab, FUZZY_THRESHOLD,
+    source=VOCABULARY_SOURCE or None,
+    poll_interval=VOCABULARY_POLL_INTERVAL,
+    on_swap=RESULT_CACHE.clear,
+    loaded_from=VOCABULARY_SOURCE or VOCAB_SOURCE,
+)
+VOCABULARY.start()
+
+# The tokenizers do not depend on the keyword lists
+sentence_splitter, word_tokenizer = _vocab.tokenizers
+span_tokenizer = SpanTokenizer(sentence_splitter, word_tokenizer, fast=TOKENIZER != "punkt")
+
+def result_cache_key(text, vocab, verbose=False):
+    """Whitespace- and case-normalized text plus the vocabulary version and response mode."""
+    return (vocab.version, verbose, " ".join(text.split()).lower())
+
+# Keyword matching is case-insensitive, so an entry keeps the raw matches
+# alongside the response: a request that differs only in case/whitespace
+# reuses them and re-runs just build_extraction() with its own tokens, so
+# raw fields (aliases_raw, match_logs terms, ...) keep the request's casing.
+CachedExtraction = namedtuple("CachedExtraction", "text lowered_tokens matches result")
+
+def compute_cached_extraction(text, vocab, tokens=None, matches=None, verbose=False):
+    if tokens is None:
+        tokens = my_word_tokenize(text)
+    if matches is None:
+        (matches,) = match_keywords([tokens], vocab)
+    result = build_extraction(tokens, *matches, vocab=vocab, verbose=verbose)
+    return CachedExtraction(text, [t.lower() for t in tokens], matches, result)
+
+def result_from_cache_entry(entry, text, vocab, verbose=False):
+    """The response for ``text`` from an entry filled by an equivalent text."""
+    if entry.text == text:
+        return entry.result
+    tokens = my_word_tokenize(text)
+    if [t.lower() for t in tokens] != entry.lowered_tokens:
+        return extract_products(text, vocab, verbose)
+    matches = [
+        [m._replace(term=" ".join(tokens[m.start_pos:m.end_pos + 1])) for m in group]
+        for group in entry.matches
+    ]
+    return build_extraction(tokens, *matches, vocab=vocab, verbose=verbose)
+
+def extract_products_cached(text, verbose=False):
+    """extract_products() through RESULT_CACHE, against the current vocabulary."""
+    vocab = VOCABULARY.current
+    if len(text) > RESULT_CACHE_MAX_CHARS:
+        return extract_products(text, vocab, verbose)
+    entry = RESULT_CACHE.get_or_compute(
+        result_cache_key(text, vocab, verbose),
+        lambda: compute_cached_extraction(text, vocab, verbose=verbose),
+    )
+    return result_from_cache_entry(entry, text, vocab, verbose)
+
+def with_char_spans(result, text):
+    """Copy of a verbose ``result`` whose match_logs also carry
+    start_char/end_char, the character range of the matched tokens in ``text``."""
+    spans = my_word_spans(text)
+    return dict(result, products=[product_with_char_spans(product, spans) for product in result["products"]])
+
+def product_with_char_spans(product, spans):
+    """Copy of one verbose product entry with char ranges from my_word_spans()."""
+    logs = [
+        dict(ml, start_char=spans[ml["start_pos"]][1], end_char=spans[ml["end_pos"]][2])
+        for ml in product["match_logs"]
+    ]
+    return dict(product, match_logs=logs)
 
 def parse_budget_value(budget_str):
     val = budget_str.lstrip("₹$").replace(',', '')
@@ -171,16 +582,20 @@ def parse_budget_value(budget_str):
         return None
     return val if val > 10 else None
 
-def normalize_product_name(prod):
+def normalize_product_name(prod, vocab=None):
+    if vocab is None:
+        vocab = VOCABULARY.current
     prod = prod.lower()
-    if prod.endswith('s') and prod[:-1] in PRODUCT_KEYWORDS:
+    if prod.endswith('s') and prod[:-1] in vocab.product_set:
         return prod[:-1]
     return prod
 
 def normalize_brand_name(brand):
     return brand.lower()
 
-def normalize_color_name(color):
+def normalize_color_name(color, vocab=None):
+    if vocab is None:
+        vocab = VOCABULARY.current
     color = color.lower().strip()
     # British spelling → American
     color = color.replace("colour", "color")
@@ -188,52 +603,24 @@ def normalize_color_name(color):
     if color.endswith(" color"):
         color = color.rsplit(" color", 1)[0].strip()
     # Map shades → root (including grey → gray)
-    color = SHADE_TO_ROOT.get(color, color)
+    color = vocab.shade_to_root.get(color, color)
     return color
 
-def find_matches_multiword(tokens, phrases, type_):
-    matches = []
-    n = len(tokens)
-    for phrase in phrases:
-        phrase_tokens = phrase.lower().split()
-        length = len(phrase_tokens)
-        for i in range(n - length + 1):
-            window = tokens[i:i+length]
-            window_str = " ".join([t.lower() for t in window])
-            score = fuzz.ratio(window_str, phrase.lower())
-            if score >= FUZZY_THRESHOLD:
-                matches.append({
-                    "term": " ".join(window),
-                    "matched_with": phrase,
-                    "start_pos": i,
-                    "end_pos": i + length - 1,
-                    "score": score,
-                    "type": type_,
-                })
-    return matches
-
-def dedupe_matches_by_window(matches):
-    best = {}
-    for m in matches:
-        key = (m["start_pos"], m["end_pos"], m["type"])
-        prev = best.get(key)
-        def choice_tuple(x):
-            exact = 1 if x["term"].lower() == x["matched_with"].lower() else 0
-            length = len(x["matched_with"])
-            return (exact, length, x["score"])
-        if prev is None or choice_tuple(m) > choice_tuple(prev):
-            best[key] = m
-    return list(best.values())
-
 def closest_indices_within_threshold(pos, positions, threshold):
-    """Return all indices whose distance equals the minimal distance and is within threshold."""
+    """Return all indices whose distance equals the minimal distance and is within threshold.
+
+    ``positions`` must be sorted; the nearest neighbours are found by bisection.
+    """
     if not positions:
         return []
-    dists = [abs(pos - p) for p in positions]
-    min_d = min(dists)
+    k = bisect_left(positions, pos)
+    min_d = min(abs(pos - positions[i]) for i in (k - 1, k) if 0 <= i < len(positions))
     if min_d > threshold:
         return []
-    return [i for i, d in enumerate(dists) if d == min_d]
+    idxs = []
+    for target in sorted({pos - min_d, pos + min_d}):
+        idxs.extend(range(bisect_left(positions, target), bisect_right(positions, target)))
+    return idxs
 
 def longest_name(names):
     if not names:
@@ -242,6 +629,10 @@ def longest_name(names):
         return (len(s.split()), len(s))
     return sorted(set(names), key=key_fn, reverse=True)[0]
 
+def merged_field(entries, field):
+    """Sorted distinct values of ``field`` across the entries of a merge group."""
+    return sorted(set(chain.from_iterable(e[field] for e in entries)))
+
 # ✅ Product merge: fuzzy + positional; allow simple plural collapse
 def should_merge_products(name_a, name_b, min_pos_dist):
     if min_pos_dist > FUZZY_PRODUCT_MERGE_WINDOW:
@@ -254,149 +645,159 @@ def should_merge_products(name_a, name_b, min_pos_dist):
         return True
     return False
 
-def spans_equal(m1, m2):
-    return m1["start_pos"] == m2["start_pos"] and m1["end_pos"] == m2["end_pos"]
+# =========================
+# Match resolution
+# =========================
+def match_preference(m):
+    """Rank of a match among matches on the same window: exact text, then phrase length, then score."""
+    exact = 1 if m.term.lower() == m.matched_with.lower() else 0
+    return (exact, len(m.matched_with), m.score)
 
-def filter_brand_overlaps_with_products(brand_matches, product_matches):
-    """Drop any brand match that exactly overlaps a product match with identical text (e.g., 'Sony Xperia')."""
-    filtered = []
-    for b in brand_matches:
-        drop = False
-        for p in product_matches:
-            if spans_equal(b, p) and b["matched_with"].lower() == p["matched_with"].lower():
-                drop = True
-                break
-        if not drop:
-            filtered.append(b)
-    return filtered
-
-def remove_overlapping_matches(matches):
-    """Remove overlapping matches, keeping the longest/best match for each overlap."""
-    if not matches:
-        return []
-    
-    # Sort by start position, then by length (descending), then by score (descending)
-    matches = sorted(matches, key=lambda m: (m["start_pos"], -len(m["matched_with"]), -m["score"]))
-    
-    filtered = []
-    for match in matches:
-        # Check if this match overlaps with any already accepted match
-        overlaps = False
-        for accepted in filtered:
-            # Check for overlap: one starts before the other ends
-            if (match["start_pos"] <= accepted["end_pos"] and 
-                match["end_pos"] >= accepted["start_pos"]):
-                overlaps = True
-                break
-        
-        if not overlaps:
-            filtered.append(match)
-    
-    return filtered
+def best_per_window(matches):
+    """Keep the preferred match for each (start, end, type) window, in first-seen order."""
+    best = {}
+    for m in matches:
+        key = (m.start_pos, m.end_pos, m.type)
+        prev = best.get(key)
+        if prev is None or match_preference(m) > match_preference(prev):
+            best[key] = m
+    return list(best.values())
 
-@app.route("/extract", methods=["POST"])
-def extract():
-    text = request.json.get("text", "")
-    tokens = my_word_tokenize(text)
+@METRICS.timed(STAGE_SECONDS, ("resolve",))
+def resolve_matches(product_matches, brand_matches, color_matches, last_end=-1):
+    """Resolve raw keyword matches into (products, brands, colors).
+
+    Products are sorted once by (start, longest phrase, best score) and
+    swept once: a match is kept unless it starts inside the last kept one
+    (or at or before ``last_end``, where a previous window's last kept
+    product ended), so the kept products never overlap. Brands and colors
+    keep their best match per window, and a brand that covers exactly a
+    kept product's span with the same text is dropped (e.g. "Sony Xperia").
+    """
+    products = []
+    for m in sorted(product_matches, key=lambda m: (m.start_pos, -len(m.matched_with), -m.score)):
+        if m.start_pos > last_end:
+            products.append(m)
+            last_end = m.end_pos
+
+    product_spans = {(p.start_pos, p.end_pos, p.matched_with.lower()) for p in products}
+    brands = [
+        b for b in best_per_window(brand_matches)
+        if (b.start_pos, b.end_pos, b.matched_with.lower()) not in product_spans
+    ]
+    return products, brands, best_per_window(color_matches)
 
-    product_matches = find_matches_multiword(tokens, PRODUCT_KEYWORDS, "product")
-    product_matches = remove_overlapping_matches(product_matches)
-    product_matches = dedupe_matches_by_window(product_matches)
-    
-    brand_matches   = dedupe_matches_by_window(find_matches_multiword(tokens, BRAND_KEYWORDS,   "brand"))
-    color_matches   = dedupe_matches_by_window(find_matches_multiword(tokens, COLOR_KEYWORDS,   "color"))
+@METRICS.timed(STAGE_SECONDS, ("match",))
+def match_keywords(token_lists, vocab=None):
+    """Run the product/brand/color matchers over a batch of token lists.
 
-    # 🔒 Prevent "Sony Xperia" (brand) when "Sony Xperia" is already a product at same span
-    brand_matches = filter_brand_overlaps_with_products(brand_matches, product_matches)
+    All windows of the batch share one candidate pass over the vocabulary's
+    q-gram index and one scoring call per matcher; returns one
+    (product_matches, brand_matches, color_matches) tuple per token list.
+    """
+    if vocab is None:
+        vocab = VOCABULARY.current
+    candidates = vocab.index.candidates_batch(token_lists)
+    return list(zip(
+        vocab.product_matcher.match_batch(token_lists, candidates),
+        vocab.brand_matcher.match_batch(token_lists, candidates),
+        vocab.color_matcher.match_batch(token_lists, candidates),
+    ))
 
+def extract_products(text, vocab=None, verbose=False):
+    """Run the full extraction pipeline on one text and return the response dict."""
+    if vocab is None:
+        vocab = VOCABULARY.current
+    tokens = my_word_tokenize(text)
+    if len(tokens) > EXTRACT_WINDOW_TOKENS:
+        return extract_windowed(tokens, vocab, verbose)
+    (matches,) = match_keywords([tokens], vocab)
+    return build_extraction(tokens, *matches, vocab=vocab, verbose=verbose)
+
+def find_quantities_and_budgets(tokens):
+    """Budget matches (numbers over 10, optionally ₹/$-prefixed) and quantity
+    matches (the other bare numbers up to 100)."""
     quantity_matches, budget_matches = [], []
     for i, tok in enumerate(tokens):
         budget_val = parse_budget_value(tok)
         if budget_val is not None:
-            budget_matches.append({
-                "term": tok, "start_pos": i, "end_pos": i,
-                "score": 100.0, "type": "budget", "matched_with": tok
-            })
+            budget_matches.append(Match(tok, tok, i, i, 100.0, "budget"))
         elif re.fullmatch(r"\d+", tok):
             val = int(tok)
             if val <= 100:
-                quantity_matches.append({
-                    "term": tok, "start_pos": i, "end_pos": i,
-                    "score": 100.0, "type": "quantity", "matched_with": tok
-                })
+                quantity_matches.append(Match(tok, tok, i, i, 100.0, "quantity"))
+    return quantity_matches, budget_matches
 
-    if not product_matches:
-        response_data = {"products": [], "total_products": 0}
-        # Save to database
-        save_query(text, response_data)
-        return jsonify(response_data)
-
-    product_matches = sorted(product_matches, key=lambda m: m["start_pos"])
-    product_positions = [m["start_pos"] for m in product_matches]
+@METRICS.timed(STAGE_SECONDS, ("attach",))
+def attach_matches(product_matches, brand_matches, color_matches, quantity_matches, budget_matches, vocab):
+    """One entry per product match, with every color/brand/quantity/budget
+    attached to its closest product(s). ``product_matches`` must be sorted
+    by start_pos, as resolve_matches() returns them."""
+    product_positions = [m.start_pos for m in product_matches]
 
     products_output = []
     for pm in product_matches:
-        norm = normalize_product_name(pm["matched_with"])
+        norm = normalize_product_name(pm.matched_with, vocab)
         products_output.append({
             "product": norm,
             "aliases": [norm],
-            "aliases_raw": [pm["term"]],
+            "aliases_raw": [pm.term],
             "quantities": [],
             "brands": [], "brands_raw": [],
             "colors": [], "colors_raw": [],
             "budgets": [],
             "match_logs": [pm],
-            "positions": [pm["start_pos"]]
+            "positions": [pm.start_pos]
         })
 
     # -------------------------
     # Attach colors (equidistant attach supported)
     # -------------------------
     for c in color_matches:
-        idxs = closest_indices_within_threshold(c["start_pos"], product_positions, COLOR_PROXIMITY)
+        idxs = closest_indices_within_threshold(c.start_pos, product_positions, COLOR_PROXIMITY)
         if not idxs:
             continue
-        color_norm = normalize_color_name(c["matched_with"])
+        color_norm = normalize_color_name(c.matched_with, vocab)
         for idx in idxs:
             if color_norm not in products_output[idx]["colors"]:
                 products_output[idx]["colors"].append(color_norm)
-            if c["term"] not in products_output[idx]["colors_raw"]:
-                products_output[idx]["colors_raw"].append(c["term"])
+            if c.term not in products_output[idx]["colors_raw"]:
+                products_output[idx]["colors_raw"].append(c.term)
             products_output[idx]["match_logs"].append(c)
 
     # -------------------------
     # Attach brands/quantities/budgets (equidistant attach supported)
     # -------------------------
     for b in brand_matches:
-        idxs = closest_indices_within_threshold(b["start_pos"], product_positions, BRAND_PROXIMITY)
+        idxs = closest_indices_within_threshold(b.start_pos, product_positions, BRAND_PROXIMITY)
         if not idxs:
             continue
-        brand_norm = normalize_brand_name(b["matched_with"])
+        brand_norm = normalize_brand_name(b.matched_with)
         for idx in idxs:
             # Avoid adding a brand that is literally identical to this product alias (e.g., "sony xperia")
             if brand_norm == products_output[idx]["product"]:
                 continue
             if brand_norm not in products_output[idx]["brands"]:
                 products_output[idx]["brands"].append(brand_norm)
-            if b["term"] not in products_output[idx]["brands_raw"]:
-                products_output[idx]["brands_raw"].append(b["term"])
+            if b.term not in products_output[idx]["brands_raw"]:
+                products_output[idx]["brands_raw"].append(b.term)
             products_output[idx]["match_logs"].append(b)
 
     for q in quantity_matches:
-        idxs = closest_indices_within_threshold(q["start_pos"], product_positions, QUANTITY_PROXIMITY)
+        idxs = closest_indices_within_threshold(q.start_pos, product_positions, QUANTITY_PROXIMITY)
         if not idxs:
             continue
-        val = int(q["matched_with"])
+        val = int(q.matched_with)
         for idx in idxs:
             if val not in products_output[idx]["quantities"]:
                 products_output[idx]["quantities"].append(val)
             products_output[idx]["match_logs"].append(q)
 
     for bd in budget_matches:
-        idxs = closest_indices_within_threshold(bd["start_pos"], product_positions, BUDGET_PROXIMITY)
+        idxs = closest_indices_within_threshold(bd.start_pos, product_positions, BUDGET_PROXIMITY)
         if not idxs:
             continue
-        val = parse_budget_value(bd["matched_with"])
+        val = parse_budget_value(bd.matched_with)
         if val is None:
             continue
         for idx in idxs:
@@ -404,73 +805,604 @@ def extract():
                 products_output[idx]["budgets"].append(val)
             products_output[idx]["match_logs"].append(bd)
 
-    # -------------------------
-    # Controlled fuzzy merging (products)
-    # -------------------------
-    def min_pos_dist(a, b):
-        return min(abs(pa - pb) for pa in a["positions"] for pb in b["positions"])
+    return products_output
+
+def merge_groups(products_output):
+    """Controlled fuzzy merging of the attached product entries: lists of
+    entry indexes, in order of their first (leading) entry."""
+    product_positions = [e["positions"][0] for e in products_output]
 
+    # Each entry still has a single position here and the entries are sorted
+    # by it, so only the entries up to FUZZY_PRODUCT_MERGE_WINDOW tokens
+    # after a group's first entry can join that group.
     used = [False] * len(products_output)
-    merged_products = []
+    groups = []
     for i in range(len(products_output)):
         if used[i]:
             continue
         group = [i]
         used[i] = True
-        for j in range(i + 1, len(products_output)):
+        window_end = bisect_right(product_positions, product_positions[i] + FUZZY_PRODUCT_MERGE_WINDOW)
+        for j in range(i + 1, window_end):
             if used[j]:
                 continue
             if should_merge_products(
                 products_output[i]["product"],
                 products_output[j]["product"],
-                min_pos_dist(products_output[i], products_output[j])
+                product_positions[j] - product_positions[i]
             ):
                 group.append(j)
                 used[j] = True
+        groups.append(group)
+    return groups
 
-        group_entries = [products_output[k] for k in group]
-        best_name = longest_name([e["product"] for e in group_entries])
-        merged_entry = {
-            "product": best_name,
-            "aliases": sorted(set(sum([e["aliases"] for e in group_entries], []))),
-            "aliases_raw": sorted(set(sum([e["aliases_raw"] for e in group_entries], []))),
-            "quantities": sorted(set(sum([e["quantities"] for e in group_entries], []))),
-            "brands": sorted(set(sum([e["brands"] for e in group_entries], []))),
-            "brands_raw": sorted(set(sum([e["brands_raw"] for e in group_entries], []))),
-            "colors": sorted(set(sum([e["colors"] for e in group_entries], []))),
-            "colors_raw": sorted(set(sum([e["colors_raw"] for e in group_entries], []))),
-            "budgets": sorted(set(sum([e["budgets"] for e in group_entries], []))),
-            "positions": sorted(set(sum([e["positions"] for e in group_entries], []))),
-            "match_logs": []
-        }
+def merged_entry(group_entries, verbose=False):
+    """The response entry for one merge group."""
+    best_name = longest_name([e["product"] for e in group_entries])
+    merged = {
+        "product": best_name,
+        "aliases": merged_field(group_entries, "aliases"),
+        "quantities": merged_field(group_entries, "quantities"),
+        "brands": merged_field(group_entries, "brands"),
+        "brands_raw": merged_field(group_entries, "brands_raw"),
+        "colors": merged_field(group_entries, "colors"),
+        "colors_raw": merged_field(group_entries, "colors_raw"),
+        "budgets": merged_field(group_entries, "budgets"),
+    }
 
+    if verbose:
+        merged["aliases_raw"] = merged_field(group_entries, "aliases_raw")
+        merged["positions"] = merged_field(group_entries, "positions")
+        merged["match_logs"] = []
         seen_logs = set()
         for e in group_entries:
             for ml in e["match_logs"]:
-                ml_id = (ml["type"], ml["term"], ml["start_pos"], ml["end_pos"])
+                ml_id = (ml.type, ml.term, ml.start_pos, ml.end_pos)
                 if ml_id not in seen_logs:
-                    merged_entry["match_logs"].append(ml)
+                    merged["match_logs"].append(ml._asdict())
                     seen_logs.add(ml_id)
+    return merged
+
+@METRICS.timed(STAGE_SECONDS, ("merge",))
+def merge_products(products_output, verbose=False):
+    """Controlled fuzzy merging of the attached product entries."""
+    return [
+        merged_entry([products_output[k] for k in group], verbose)
+        for group in merge_groups(products_output)
+    ]
+
+def text_too_long(text):
+    """The error message for a text over MAX_TEXT_CHARS, else None."""
+    if len(text) > MAX_TEXT_CHARS:
+        return f"text length {len(text)} exceeds limit of {MAX_TEXT_CHARS} characters"
+    return None
+
+def build_extraction(tokens, product_matches, brand_matches, color_matches, vocab=None, verbose=False):
+    """Resolve, attach and merge raw keyword matches into the response dict.
 
-        merged_products.append(merged_entry)
+    The debug fields (aliases_raw, positions and match_logs) are only
+    built when ``verbose`` is set.
+    """
+    if vocab is None:
+        vocab = VOCABULARY.current
+    product_matches, brand_matches, color_matches = resolve_matches(
+        product_matches, brand_matches, color_matches
+    )
+    if not product_matches:
+        return {"products": [], "total_products": 0}
+
+    quantity_matches, budget_matches = find_quantities_and_budgets(tokens)
+    products_output = attach_matches(
+        product_matches, brand_matches, color_matches, quantity_matches, budget_matches, vocab
+    )
+    merged_products = merge_products(products_output, verbose)
+    return {"products": merged_products, "total_products": len(merged_products)}
+
+# =========================
+# Windowed extraction
+# =========================
+# Long transcripts are matched EXTRACT_WINDOW_TOKENS tokens at a time, so
+# only one window's candidate matches are ever held. A modifier attaches to
+# the nearest product within its proximity, so a product entry is final
+# once every product up to ATTACH_HORIZON tokens after it is known, and a
+# merge group once its last possible member's entry is final.
+ATTACH_HORIZON = 2 * max(BRAND_PROXIMITY, COLOR_PROXIMITY, QUANTITY_PROXIMITY, BUDGET_PROXIMITY)
 
-    response_data = {"products": merged_products, "total_products": len(merged_products)}
-    
-    # Save to database
-    save_query(text, response_data)
-    
+def window_match_order(raw_matches, resolved, rank):
+    """(order key, match) for ``resolved`` brand/color matches, keyed so that
+    sorting restores the order match_keywords() gives a whole text: by the
+    best-ranked phrase that hit the match's window, then by start."""
+    first = {}
+    for m in raw_matches:
+        # Matches come ordered by phrase index, so the first hit ranks best
+        first.setdefault((m.start_pos, m.end_pos), rank[m.matched_with])
+    return [((first[(m.start_pos, m.end_pos)], m.start_pos), m) for m in resolved]
+
+def iter_products_windowed(tokens, vocab=None, verbose=False, window=None):
+    """Yield the merged products of ``tokens`` in response order, each as
+    soon as it is final; the same products build_extraction() returns.
+
+    Each window of tokens is matched with enough lookahead for the longest
+    phrase starting in it. Only the products and modifiers still within
+    reach of an unfinished entry are kept between windows.
+    """
+    if vocab is None:
+        vocab = VOCABULARY.current
+    window = window or EXTRACT_WINDOW_TOKENS
+    matchers = (vocab.product_matcher, vocab.brand_matcher, vocab.color_matcher)
+    lookahead = max(m.max_tokens for m in matchers) - 1
+    T = ATTACH_HORIZON // 2
+
+    products, brands, colors, quantities, budgets = [], [], [], [], []
+    consumed = set()
+    last_end = -1
+    prev_cut = float("-inf")
+    for start in range(0, len(tokens), window):
+        stop = min(start + window, len(tokens))
+        (raw,) = match_keywords([tokens[start:stop + lookahead]], vocab)
+        raw = [
+            [m._replace(start_pos=m.start_pos + start, end_pos=m.end_pos + start)
+             for m in group if m.start_pos < stop - start]
+            for group in raw
+        ]
+        new_products, new_brands, new_colors = resolve_matches(*raw, last_end=last_end)
+        if new_products:
+            last_end = new_products[-1].end_pos
+        products += new_products
+        brands += window_match_order(raw[1], new_brands, vocab.brand_matcher.rank)
+        colors += window_match_order(raw[2], new_colors, vocab.color_matcher.rank)
+        for found, chunk in zip((quantities, budgets), find_quantities_and_budgets(tokens[start:stop])):
+            found += [m._replace(start_pos=m.start_pos + start, end_pos=m.end_pos + start) for m in chunk]
+
+        last = stop == len(tokens)
+        complete = float("inf") if last else stop - ATTACH_HORIZON
+        cut = float("inf") if last else complete - FUZZY_PRODUCT_MERGE_WINDOW
+        if products and cut > prev_cut:
+            brands.sort(key=itemgetter(0))
+            colors.sort(key=itemgetter(0))
+            entries = [
+                e for e in attach_matches(
+                    products, [m for _, m in brands], [m for _, m in colors], quantities, budgets, vocab
+                )
+                if prev_cut <= e["positions"][0] < complete and e["positions"][0] not in consumed
+            ]
+            for group in merge_groups(entries):
+                if entries[group[0]]["positions"][0] >= cut:
+                    break
+                group_entries = [entries[k] for k in group]
+                consumed.update(e["positions"][0] for e in group_entries)
+                yield merged_entry(group_entries, verbose)
+        if last:
+            return
+
+        prev_cut = cut
+        products = [m for m in products if m.start_pos >= cut - 2 * T]
+        brands = [b for b in brands if b[1].start_pos >= cut - T]
+        colors = [c for c in colors if c[1].start_pos >= cut - T]
+        quantities = [m for m in quantities if m.start_pos >= cut - T]
+        budgets = [m for m in budgets if m.start_pos >= cut - T]
+        consumed = {pos for pos in consumed if pos >= cut}
+
+def extract_windowed(tokens, vocab=None, verbose=False, window=None):
+    """build_extraction() for a long token list, in bounded memory."""
+    products = list(iter_products_windowed(tokens, vocab, verbose, window))
+    return {"products": products, "total_products": len(products)}
+
+def response_options(body):
+    """(verbose, char_spans) request flags; char spans live in match_logs, so they imply verbose."""
+    char_spans = bool(body.get("char_spans"))
+    return bool(body.get("verbose")) or char_spans, char_spans
+
+@app.route("/extract", methods=["POST"])
+def extract():
+    text = request.json.get("text", "")
+    error = text_too_long(text)
+    if error:
+        return jsonify({"error": error}), 413
+    verbose, char_spans = response_options(request.json)
+    response_data = extract_products_cached(text, verbose)
+    if METRICS.enabled:
+        record_response(response_data)
+
+    # Queue for the background writer
+    QUERY_LOG.submit(text, response_data)
+
+    if char_spans:
+        response_data = with_char_spans(response_data, text)
     return jsonify(response_data)
 
+@app.route("/extract/batch", methods=["POST"])
+def extract_batch():
+    """Extract products from a list of texts in one request.
+
+    Cached texts are answered from RESULT_CACHE; tokenization and keyword
+    scoring for the rest are shared across the batch, and all rows are
+    handed to the query log together. Results come back in input order,
+    and an item that fails (or is over MAX_TEXT_CHARS) only gets its own
+    {"error": ...} entry. Texts over EXTRACT_WINDOW_TOKENS tokens are
+    extracted window by window, outside the shared pass.
+    ``"verbose"`` and ``"char_spans"`` apply to every item, as for /extract.
+    """
+    texts = request.json.get("texts")
+    if not isinstance(texts, list):
+        return jsonify({"error": "'texts' must be a list of strings"}), 400
+    if len(texts) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"batch size {len(texts)} exceeds limit of {MAX_BATCH_SIZE}"}), 413
+
+    verbose, char_spans = response_options(request.json)
+    vocab = VOCABULARY.current
+    results = [None] * len(texts)
+    valid = []
+    for i, text in enumerate(texts):
+        if not isinstance(text, str):
+            results[i] = {"error": "text must be a string"}
+            continue
+        error = text_too_long(text)
+        if error:
+            results[i] = {"error": error}
+            continue
+        if len(text) <= RESULT_CACHE_MAX_CHARS:
+            found, entry = RESULT_CACHE.get(result_cache_key(text, vocab, verbose))
+            if found and entry.text == text:
+                results[i] = entry.result
+                continue
+        try:
+            tokens = my_word_tokenize(text)
+            if len(tokens) > EXTRACT_WINDOW_TOKENS:
+                results[i] = extract_windowed(tokens, vocab, verbose)
+            else:
+                valid.append((i, text, tokens))
+        except Exception as e:
+            results[i] = {"error": str(e)}
+
+    batch_matches = match_keywords([tokens for _, _, tokens in valid], vocab)
+    for (i, text, tokens), matches in zip(valid, batch_matches):
+        try:
+            entry = compute_cached_extraction(text, vocab, tokens, matches, verbose)
+        except Exception as e:
+            results[i] = {"error": str(e)}
+            continue
+        results[i] = entry.result
+        if len(text) <= RESULT_CACHE_MAX_CHARS:
+            RESULT_CACHE.put(result_cache_key(text, vocab, verbose), entry)
+
+    rows = [(text, result) for text, result in zip(texts, results) if "error" not in result]
+    if METRICS.enabled:
+        for _, result in rows:
+            record_response(result)
+
+    QUERY_LOG.submit_many(rows)
+
+    if char_spans:
+        results = [
+            result if "error" in result else with_char_spans(result, text)
+            for text, result in zip(texts, results)
+        ]
+    return jsonify({"results": results, "total": len(results)})
+
+def query_flag(name, default=False):
+    """Boolean query-string parameter ("1", "true", "yes", "on" are true)."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+def ndjson_records(lines):
+    """(line, id, text, error) for every non-blank NDJSON line; a line is
+    either a JSON string or an object with "text" and an optional "id"."""
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, None, f"invalid JSON: {e}"
+            continue
+        if isinstance(record, str):
+            yield line_no, None, record, None
+        elif isinstance(record, dict) and isinstance(record.get("text"), str):
+            yield line_no, record.get("id"), record["text"], None
+        else:
+            yield line_no, None, None, "record must be a string or an object with a string 'text'"
+
+def csv_records(reader, text_column, id_column):
+    """(line, id, text, error) for every row of a csv.DictReader."""
+    for row in reader:
+        text = row.get(text_column)
+        if text is None:
+            yield reader.line_num, row.get(id_column), None, f"missing '{text_column}' value"
+        else:
+            yield reader.line_num, row.get(id_column), text, None
+
+def extract_records(records, vocab, verbose=False, char_spans=False):
+    """Output dicts for a batch of (line, id, text, error) records, plus the
+    (text, result) rows to persist. The texts share one keyword-matching
+    pass and bypass RESULT_CACHE, so bulk re-processing does not evict live
+    entries; texts over EXTRACT_WINDOW_TOKENS tokens are extracted window
+    by window instead."""
+    outputs, valid, rows = [], [], []
+    for line_no, record_id, text, error in records:
+        out = {"line": line_no}
+        if record_id is not None:
+            out["id"] = record_id
+        if error is None:
+            error = text_too_long(text)
+        if error is None:
+            try:
+                valid.append((out, text, my_word_tokenize(text)))
+            except Exception as e:
+                error = str(e)
+        if error is not None:
+            out["error"] = error
+        outputs.append(out)
+
+    batch_matches = iter(match_keywords(
+        [tokens for _, _, tokens in valid if len(tokens) <= EXTRACT_WINDOW_TOKENS], vocab
+    ))
+    for out, text, tokens in valid:
+        try:
+            if len(tokens) > EXTRACT_WINDOW_TOKENS:
+                result = extract_windowed(tokens, vocab, verbose)
+            else:
+                result = build_extraction(tokens, *next(batch_matches), vocab=vocab, verbose=verbose)
+        except Exception as e:
+            out["error"] = str(e)
+            continue
+        rows.append((text, result))
+        out.update(with_char_spans(result, text) if char_spans else result)
+    return outputs, rows
+
+@app.route("/extract/stream", methods=["POST"])
+def extract_stream():
+    """Extract products from every record of an NDJSON or CSV body as it is read.
+
+    NDJSON (the default): one JSON string or {"text": ..., "id": ...} object
+    per line. CSV (Content-Type: text/csv): a header row with a "text" column
+    (?text_column=) and an optional "id" column (?id_column=).
+
+    The response is NDJSON with one line per record, in input order:
+    {"line": <input line>, "id": ..., "products": [...], "total_products": ...},
+    or {"line": ..., "error": ...} for a record that failed. Records are read,
+    matched STREAM_BATCH_SIZE at a time and written back before the next
+    batch is read, so memory does not grow with the upload. Query flags:
+    verbose, char_spans, and persist=0 to skip the query log.
+    """
+    verbose = query_flag("verbose") or query_flag("char_spans")
+    char_spans = query_flag("char_spans")
+    persist = query_flag("persist", default=True)
+
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace", newline="")
+    if request.mimetype == "text/csv":
+        text_column = request.args.get("text_column", "text")
+        reader = csv.DictReader(lines)
+        if text_column not in (reader.fieldnames or []):
+            return jsonify({"error": f"CSV header has no '{text_column}' column"}), 400
+        records = csv_records(reader, text_column, request.args.get("id_column", "id"))
+    else:
+        records = ndjson_records(lines)
+
+    def generate():
+        vocab = VOCABULARY.current
+        while True:
+            batch = list(islice(records, STREAM_BATCH_SIZE))
+            if not batch:
+                return
+            outputs, rows = extract_records(batch, vocab, verbose, char_spans)
+            if METRICS.enabled:
+                for _, result in rows:
+                    record_response(result)
+            if persist:
+                QUERY_LOG.submit_many(rows)
+            yield "".join(json.dumps(out) + "\n" for out in outputs)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/extract/transcript", methods=["POST"])
+def extract_transcript():
+    """Extract products from one long text, such as a dictated transcript.
+
+    Takes the same body as /extract. The response is NDJSON: one product
+    entry per line, written as soon as it is final (see
+    iter_products_windowed), then {"total_products": N}. The products are
+    the ones /extract returns, in the same order; the whole result goes to
+    the query log once the last one is written.
+    """
+    text = request.json.get("text", "")
+    error = text_too_long(text)
+    if error:
+        return jsonify({"error": error}), 413
+    verbose, char_spans = response_options(request.json)
+    vocab = VOCABULARY.current
+    tokens = my_word_tokenize(text)
+    spans = my_word_spans(text) if char_spans else None
+
+    def generate():
+        products = []
+        for product in iter_products_windowed(tokens, vocab, verbose):
+            products.append(product)
+            yield json.dumps(product_with_char_spans(product, spans) if char_spans else product) + "\n"
+        result = {"products": products, "total_products": len(products)}
+        if METRICS.enabled:
+            record_response(result)
+        QUERY_LOG.submit(text, result)
+        yield json.dumps({"total_products": len(products)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/admin/vocabulary", methods=["GET"])
+def vocabulary_status():
+    """Active vocabulary version, its source and the last rebuild time."""
+    return jsonify(VOCABULARY.status())
+
+@app.route("/admin/vocabulary/reload", methods=["POST"])
+def vocabulary_reload():
+    """Re-read the vocabulary source now instead of waiting for the watcher."""
+    if not VOCABULARY.source:
+        return jsonify({"error": "no VOCABULARY_SOURCE configured"}), 400
+    swapped = VOCABULARY.reload(force=True)
+    return jsonify(dict(VOCABULARY.status(), swapped=swapped))
+
 @app.route("/history", methods=["GET"])
 def history():
-    """Get the last 10 queries from the database."""
+    """Get recent queries from the database, newest first.
+
+    Optional filters: product, brand, color, since, until (ISO 8601, UTC)
+    and q (words of the raw text). ``limit`` (default 10, at most
+    HISTORY_MAX_LIMIT) sets the page size; pass the response's
+    ``next_cursor`` as ``cursor`` for the next page. With ``archived=1``,
+    pages continue past the live rows into the archived partitions.
+    """
+    args = request.args
+    try:
+        limit = min(max(int(args.get("limit", 10)), 1), HISTORY_MAX_LIMIT)
+        cursor = decode_history_cursor(args["cursor"]) if args.get("cursor") else None
+        since = history_timestamp(args["since"]) if args.get("since") else None
+        until = history_timestamp(args["until"]) if args.get("until") else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        filters = dict(product=args.get("product"), brand=args.get("brand"), color=args.get("color"),
+                       since=since, until=until, text=(args.get("q") or "").strip() or None)
+        queries, next_cursor = get_recent_queries(limit, cursor, **filters)
+        if query_flag("archived") and next_cursor is None and len(queries) < limit:
+            # Archived partitions are all older than the live rows
+            after = (queries[-1]['created_at'], queries[-1]['id']) if queries else cursor
+            rows, more = ARCHIVES.get_queries(limit - len(queries), after, **filters)
+            queries += [history_entry(row) for row in rows]
+            if more:
+                next_cursor = encode_history_cursor(queries[-1]['created_at'], queries[-1]['id'])
+        return jsonify({"queries": queries, "total": len(queries), "next_cursor": next_cursor})
+    except sqlite3.OperationalError as e:
+        if filters["text"] and str(e).startswith("fts5:"):
+            return jsonify({"error": f"invalid q: {e}"}), 400
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Query counts and top products/brands/colors/budget bands, from the rollups.
+
+    ``since``/``until`` (ISO 8601, UTC; default the last 24 hours) are
+    truncated to the hour, ``top`` (default 10) sets the list lengths, and
+    ``by=hour`` or ``by=day`` adds a per-bucket "series".
+    """
+    args = request.args
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        until = history_timestamp(args["until"]) if args.get("until") else \
+            (now + timedelta(hours=1)).strftime("%Y-%m-%d %H:00:00")
+        since = history_timestamp(args["since"]) if args.get("since") else \
+            (now - timedelta(hours=23)).strftime("%Y-%m-%d %H:00:00")
+        top = min(max(int(args.get("top", 10)), 1), STATS_MAX_TOP)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    by = args.get("by")
+    if by not in (None, "hour", "day"):
+        return jsonify({"error": "by must be 'hour' or 'day'"}), 400
+    span_hours = (datetime.fromisoformat(until) - datetime.fromisoformat(since)).total_seconds() / 3600
+    if by and span_hours / (24 if by == "day" else 1) > STATS_MAX_SERIES_BUCKETS:
+        return jsonify({"error": f"more than {STATS_MAX_SERIES_BUCKETS} {by} buckets; narrow the range"}), 400
+
     try:
-        queries = get_recent_queries(10)
-        return jsonify({"queries": queries, "total": len(queries)})
+        result = get_stats(since, until, top)
+        if by:
+            result["series"] = get_stats_series(since, until, by, top)
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+STARTUP_TIMINGS["total"] = time.perf_counter() - _IMPORT_STARTED
+
+def startup_report():
+    """Import-time breakdown for this process."""
+    return {
+        "vocabulary_version": VOCABULARY.current.version,
+        "vocabulary_source": VOCAB_SOURCE,
+        "timings": STARTUP_TIMINGS,
+    }
+
+def measure_startup(runs):
+    """Import the app in ``runs`` fresh interpreters and summarize cold-start time."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = "import json, app; print(json.dumps(app.startup_report()))"
+    reports, walls = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, check=True,
+                             capture_output=True, text=True).stdout
+        walls.append(time.perf_counter() - started)
+        reports.append(json.loads(out.strip().splitlines()[-1]))
+
+    summary = {}
+    for stage in reports[0]["timings"]:
+        values = [r["timings"][stage] for r in reports]
+        summary[stage] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    summary["process_wall"] = {"median": statistics.median(walls), "min": min(walls), "max": max(walls)}
+    return {
+        "runs": runs,
+        "vocabulary_version": reports[0]["vocabulary_version"],
+        "vocabulary_source": reports[0]["vocabulary_source"],
+        "seconds": summary,
+    }
+
 if __name__ == "__main__":
-    # Initialize database on startup
-    init_database()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    parser = argparse.ArgumentParser(description="WhisperCart extraction backend")
+    parser.add_argument("--build-artifact", nargs="?", const=VOCABULARY_ARTIFACT_PATH, metavar="PATH",
+                        help="compile the vocabulary and tokenizers into an artifact and exit")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="measure cold-start import time in fresh interpreters and exit")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters to start for --startup-time")
+    parser.add_argument("--rebuild-rollups", nargs="?", const="", metavar="SINCE",
+                        help="recompute the /stats rollups from the query history (from SINCE, ISO 8601) and exit")
+    parser.add_argument("--archive", action="store_true",
+                        help="move query-log partitions older than QUERY_RETENTION_DAYS to QUERY_ARCHIVE_DIR and exit")
+    parser.add_argument("--migrate", action="store_true",
+                        help="bring the database schema up to date, report the space it takes before and after, and exit")
+    parser.add_argument("--debug", action="store_true", default=os.getenv("FLASK_DEBUG", "0") == "1",
+                        help="run the development server with Flask's debugger and reloader (default: FLASK_DEBUG=1); "
+                             "the debugger executes code for anyone who can reach it")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="one-off: switch an existing database to incremental vacuum (runs a full VACUUM) and exit")
+    args = parser.parse_args()
+
+    if args.build_artifact:
+        header = save_artifact(VOCABULARY.current, args.build_artifact)
+        print(json.dumps(dict(header, path=args.build_artifact), indent=2))
+    elif args.rebuild_rollups is not None:
+        init_database()
+        since = history_timestamp(args.rebuild_rollups) if args.rebuild_rollups else None
+        started = time.perf_counter()
+        rebuild_rollups(DB.connection(), since)
+        print(f"rollups rebuilt in {time.perf_counter() - started:.2f}s")
+    elif args.archive:
+        init_database()
+        moved = archive_query_log()
+        print(f"archived {sum(moved.values())} rows from {len(moved)} partitions to {QUERY_ARCHIVE_DIR}")
+    elif args.migrate:
+        # Measured on a plain connection: DB's first one migrates
+        before = sqlite3.connect(DATABASE_PATH)
+        version = before.execute("PRAGMA user_version").fetchone()[0]
+        size, free = database_bytes(before)
+        before.close()
+        started = time.perf_counter()
+        conn = DB.connection()
+        seconds = time.perf_counter() - started
+        reclaim_space(conn)
+        size_after, free_after = database_bytes(conn)
+        print(json.dumps({
+            "schema_version": [version, conn.execute("PRAGMA user_version").fetchone()[0]],
+            "seconds": seconds,
+            "used_bytes": [size - free, size_after - free_after],
+            "file_bytes": [size, size_after],
+        }, indent=2))
+    elif args.enable_incremental_vacuum:
+        init_database()
+        enable_incremental_vacuum(DB.connection())
+    elif args.startup_time:
+        print(json.dumps(measure_startup(args.runs), indent=2))
+    else:
+        # Initialize database on startup
+        init_database()
+        app.run(host='0.0.0.0', port=5000, debug=args.debug)
@@ -0,0 +1,301 @@
+import atexit
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from payloads import delete_orphan_payloads, payload_json
+
+# =========================
+# Partitions
+# =========================
+# The live ``queries`` table is partitioned by the calendar month (or day)
+# of created_at. Partitions older than the retention window move to
+# ``<archive_dir>/queries-<partition>.db.gz``: a gzip-compressed SQLite
+# file holding that partition's rows, read back through ArchiveReader.
+
+# created_at prefix length of a partition name ("2026-01", "2026-01-31")
+PARTITION_LENGTHS = {"month": 7, "day": 10}
+
+# Rows deleted from the live database per transaction, so the query-log
+# writer never waits long for the write lock
+DELETE_BATCH_SIZE = 1000
+
+# Pages returned to the filesystem per PRAGMA incremental_vacuum step
+VACUUM_STEP_PAGES = 2000
+
+ARCHIVE_FILE = re.compile(r"^queries-(\d{4}-\d{2}(?:-\d{2})?)\.db\.gz$")
+
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS queries (
+        id INTEGER PRIMARY KEY,
+        raw_text TEXT NOT NULL,
+        extracted_json TEXT NOT NULL,
+        created_at TIMESTAMP
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_queries_created_at ON queries(created_at)",
+]
+
+def partition_end(partition):
+    """The first created_at prefix after ``partition``; rows of the partition
+    are exactly those with partition <= created_at < partition_end(...)."""
+    if len(partition) == PARTITION_LENGTHS["day"]:
+        return (date.fromisoformat(partition) + timedelta(days=1)).isoformat()
+    year, month = map(int, partition.split("-"))
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+
+def archive_path(archive_dir, partition):
+    return os.path.join(archive_dir, f"queries-{partition}.db.gz")
+
+def live_partitions_before(conn, cutoff, granularity="month"):
+    """Partitions of the live table that end on or before the partition of
+    ``cutoff`` starts, oldest first (index seeks on idx_queries_created_at)."""
+    length = PARTITION_LENGTHS[granularity]
+    limit = cutoff[:length]
+    partitions, start = [], ""
+    while True:
+        row = conn.execute(
+            "SELECT MIN(created_at) FROM queries WHERE created_at >= ? AND created_at < ?", (start, limit)
+        ).fetchone()
+        if row[0] is None:
+            return partitions
+        partitions.append(row[0][:length])
+        start = partition_end(partitions[-1])
+
+# =========================
+# Archiving
+# =========================
+def archive_partition(conn, archive_dir, partition):
+    """Move one partition's rows from the live database into its archive file.
+
+    The rows are copied (merged into the existing archive, if any) into a
+    scratch SQLite file, which is compressed and renamed into place before
+    anything is deleted. Only rows present in the archive are then deleted,
+    DELETE_BATCH_SIZE per transaction. Returns the number of rows moved.
+    """
+    start, end = partition, partition_end(partition)
+    final = archive_path(archive_dir, partition)
+    os.makedirs(archive_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=archive_dir, prefix=".archiving-") as scratch:
+        work = os.path.join(scratch, "partition.db")
+        if os.path.exists(final):
+            with gzip.open(final, "rb") as src, open(work, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        archive = sqlite3.connect(work)
+        for statement in ARCHIVE_SCHEMA:
+            archive.execute(statement)
+        archive.commit()
+        archive.close()
+
+        # Reads the live database only; the write transaction is on the scratch
+        # file. Archives hold each row's result as inline JSON.
+        conn.create_function("payload_json", 2, payload_json, deterministic=True)
+        conn.execute("ATTACH DATABASE ? AS archive", (work,))
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO archive.queries (id, raw_text, extracted_json, created_at)
+                    SELECT q.id, q.raw_text, COALESCE(q.extracted_json, payload_json(p.encoding, p.body)), q.created_at
+                    FROM main.queries AS q LEFT JOIN main.payloads AS p ON p.id = q.payload_id
+                    WHERE q.created_at >= ? AND q.created_at < ?
+                ''', (start, end))
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+        archive = sqlite3.connect(work)
+        archive.execute("VACUUM")
+        archive.close()
+        partial = os.path.join(scratch, "partition.db.gz")
+        with open(work, "rb") as src, gzip.open(partial, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        with open(partial, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(partial, final)
+
+        moved = 0
+        conn.execute("ATTACH DATABASE ? AS archive", (work,))
+        try:
+            while True:
+                with conn:
+                    deleted = conn.execute('''
+                        DELETE FROM main.queries WHERE id IN (
+                            SELECT q.id FROM main.queries AS q JOIN archive.queries AS a ON a.id = q.id
+                            WHERE q.created_at >= ? AND q.created_at < ?
+                            LIMIT ?
+                        )
+                    ''', (start, end, DELETE_BATCH_SIZE)).rowcount
+                moved += deleted
+                if deleted < DELETE_BATCH_SIZE:
+                    return moved
+        finally:
+            conn.execute("DETACH DATABASE archive")
+
+def reclaim_space(conn):
+    """Return free pages to the filesystem in short steps; a no-op unless
+    the database uses auto_vacuum=INCREMENTAL (see enable_incremental_vacuum).
+    In WAL mode the file shrinks at the next checkpoint, started here
+    without waiting for readers or blocking writers."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            return freed
+        # Each sqlite3_step frees one page; executescript() runs it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+        freed += min(free, VACUUM_STEP_PAGES)
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing database to auto_vacuum=INCREMENTAL. This runs a
+    full VACUUM, which locks the database for its duration: do it once,
+    offline. New databases get it from DEFAULT_PRAGMAS."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def archive_old_partitions(conn, archive_dir, cutoff, granularity="month", log=None):
+    """Archive every live partition that ends before ``cutoff``'s partition
+    starts, drop the payloads only they used and reclaim the freed space.
+    Returns {partition: rows moved}."""
+    moved = {}
+    for partition in live_partitions_before(conn, cutoff, granularity):
+        moved[partition] = archive_partition(conn, archive_dir, partition)
+        if log:
+            log(f"archived {partition}: {moved[partition]} rows")
+    if moved:
+        orphans = delete_orphan_payloads(conn)
+        if log and orphans:
+            log(f"deleted {orphans} unused payloads")
+    freed = reclaim_space(conn)
+    if log and freed:
+        log(f"reclaimed {freed} pages")
+    return moved
+
+# =========================
+# Reading archived partitions
+# =========================
+class ArchiveReader:
+    """Read-only queries over the archive files of ``archive_dir``.
+
+    Each file is decompressed into a temporary directory private to the
+    process on first use; the ``cache_size`` most recently used copies are
+    kept (and refreshed when the archive file changes). ``close()``
+    removes the directory; it also runs at interpreter exit, but a process
+    leaving through os._exit() (a serve.py worker) must call it itself.
+    """
+
+    def __init__(self, archive_dir, cache_size=4):
+        self.archive_dir = archive_dir
+        self.cache_size = cache_size
+        self._cache = OrderedDict()   # partition -> (archive mtime, decompressed path)
+        self._lock = threading.Lock()
+        self._tmp = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def partitions(self):
+        """Archived partition names, newest first."""
+        try:
+            names = os.listdir(self.archive_dir)
+        except FileNotFoundError:
+            return []
+        return sorted((m.group(1) for m in map(ARCHIVE_FILE.match, names) if m), reverse=True)
+
+    def _local_copy(self, partition):
+        source = archive_path(self.archive_dir, partition)
+        mtime = os.stat(source).st_mtime_ns
+        with self._lock:
+            if self._pid != os.getpid():
+                # Copies inherited across fork() belong to the parent
+                self._cache.clear()
+                self._tmp = None
+                self._pid = os.getpid()
+            cached = self._cache.get(partition)
+            if cached and cached[0] == mtime:
+                self._cache.move_to_end(partition)
+                return cached[1]
+            if self._tmp is None:
+                self._tmp = tempfile.mkdtemp(prefix="whispercart-archive-")
+            path = os.path.join(self._tmp, f"{partition}-{mtime}.db")
+            with gzip.open(source, "rb") as src, open(path + ".part", "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(path + ".part", path)
+            if cached:
+                os.remove(cached[1])
+            self._cache[partition] = (mtime, path)
+            self._cache.move_to_end(partition)
+            while len(self._cache) > self.cache_size:
+                _, (_, old) = self._cache.popitem(last=False)
+                os.remove(old)
+            return path
+
+    def close(self):
+        """Remove this process's decompressed copies."""
+        with self._lock:
+            if self._tmp is not None and self._pid == os.getpid():
+                shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
+            self._cache.clear()
+
+    def get_queries(self, limit=10, cursor=None, product=None, brand=None, color=None,
+                    since=None, until=None, text=None):
+        """Up to ``limit`` archived (id, raw_text, extracted_json, created_at)
+        rows, newest first, with the same filters and (created_at, id)
+        cursor as the live /history, and whether more rows follow.
+
+        Archives have no side tables or full-text index, so term filters
+        use json_each() and ``text`` matches each word as a
+        case-insensitive substring, over the partitions in range.
+        """
+        where, params = [], []
+        if product:
+            where.append("EXISTS (SELECT 1 FROM json_each(q.extracted_json, '$.products') AS p "
+                         "WHERE json_extract(p.value, '$.product') = ?)")
+            params.append(product.lower())
+        for field, value in (("brands", brand), ("colors", color)):
+            if value:
+                where.append("EXISTS (SELECT 1 FROM json_each(q.extracted_json, '$.products') AS p, "
+                             f"json_each(p.value, '$.{field}') AS v WHERE v.value = ?)")
+                params.append(value.lower())
+        if since:
+            where.append("q.created_at >= ?")
+            params.append(since)
+        if until:
+            where.append("q.created_at < ?")
+            params.append(until)
+        for word in (text or "").split():
+            where.append("q.raw_text LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([%_\\])", r"\\\1", word) + "%")
+        if cursor:
+            where.append("(q.created_at, q.id) < (?, ?)")
+            params.extend(cursor)
+        sql = f'''
+            SELECT q.id, q.raw_text, q.extracted_json, q.created_at FROM queries AS q
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY q.created_at DESC, q.id DESC
+            LIMIT ?
+        '''
+
+        rows = []
+        upper = min(filter(None, [until, cursor[0] if cursor else None]), default=None)
+        for partition in self.partitions():
+            if since and partition_end(partition) <= since[:len(partition)]:
+                break
+            if upper is not None and partition > upper:
+                continue
+            conn = sqlite3.connect(f"file:{self._local_copy(partition)}?mode=ro", uri=True)
+            try:
+                rows += conn.execute(sql, params + [limit + 1 - len(rows)]).fetchall()
+            finally:
+                conn.close()
+            if len(rows) > limit:
+                break
+        return rows[:limit], len(rows) > limit
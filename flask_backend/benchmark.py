@@ -0,0 +1,392 @@
+"""Benchmarks for the /extract pipeline.
+
+    python benchmark.py run [--items 1,10,50,100] [--vocab-sizes 0,5000] [--output baseline.json]
+    python benchmark.py compare baseline.json [--threshold 0.25]
+    python benchmark.py corpus --items 20 --texts 5
+    python benchmark.py throughput --url http://127.0.0.1:5000 [--clients 8] [--seconds 10]
+    python benchmark.py check [--corpus regression_corpus.jsonl] [--update]
+
+``run`` times every stage of an extraction (tokenize, match, overlap
+resolution, attachment, merging, persistence) and the whole synchronous
+/extract path on a synthetic corpus, for each list length and vocabulary
+size, and prints or saves the per-text median and p95. The corpus is
+generated from PRODUCT_KEYWORDS, BRAND_KEYWORDS and COLOR_KEYWORDS with
+injected typos and depends only on the seed, so runs are comparable.
+
+``compare`` re-runs the configuration stored in a saved result and exits
+with status 1 if any stage's median got slower than the baseline by more
+than ``--threshold`` (a fraction) and ``--min-delta-ms``.
+
+``throughput`` posts corpus texts to /extract of a running server (serve.py)
+from concurrent client processes and reports requests per second and
+latency percentiles. Start the server with RESULT_CACHE_SIZE=0 to measure
+extraction rather than cache hits.
+
+``check`` runs every text of regression_corpus.jsonl through the tokenizer
+and the verbose /extract pipeline and exits with status 1 if the tokens or
+the response differ from the recorded ones, or if the token spans differ
+from Punkt + Treebank (the TOKENIZER=punkt path). The recorded responses
+were produced by the app before the tokenizer and matcher rewrites;
+``--update`` re-records them after an intended change of output.
+
+Queries are persisted to a temporary database, never to whispercart.db.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import urllib.request
+
+import app
+from db import ConnectionManager
+from tokenizer import SpanTokenizer
+from vocabulary import CompiledVocabulary
+
+REGRESSION_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression_corpus.jsonl")
+
+STAGES = ["tokenize", "match", "resolve", "attach", "merge", "persist", "end_to_end"]
+
+# =========================
+# Synthetic corpus
+# =========================
+FILLERS = ["and", "also", "plus", "then", "with", "and some", "and a"]
+
+def add_typo(word, rng):
+    """``word`` with one random deletion, insertion, substitution or transposition."""
+    i = rng.randrange(len(word) - 1)
+    edit = rng.choice(["delete", "insert", "substitute", "transpose"])
+    if edit == "delete":
+        return word[:i] + word[i + 1:]
+    if edit == "insert":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+    if edit == "substitute":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def keyword(keywords, rng, typo_rate):
+    words = rng.choice(keywords).split()
+    return " ".join(add_typo(w, rng) if len(w) >= 4 and rng.random() < typo_rate else w
+                    for w in words)
+
+def synthetic_item(rng, typo_rate=0.0):
+    """One '[qty] [color] [brand] product [under budget]' phrase from the keyword lists."""
+    parts = []
+    if rng.random() < 0.4:
+        parts.append(str(rng.choice([1, 2, 3, 5, 10])))
+    if rng.random() < 0.5:
+        parts.append(keyword(app.COLOR_KEYWORDS, rng, typo_rate))
+    if rng.random() < 0.5:
+        parts.append(keyword(app.BRAND_KEYWORDS, rng, typo_rate))
+    parts.append(keyword(app.PRODUCT_KEYWORDS, rng, typo_rate))
+    if rng.random() < 0.3:
+        parts += ["under", str(rng.choice([500, 1500, 5000, 20000]))]
+    return " ".join(parts)
+
+def shopping_list(rng, items, typo_rate=0.0):
+    text = synthetic_item(rng, typo_rate)
+    for _ in range(items - 1):
+        text += f" {rng.choice(FILLERS)} {synthetic_item(rng, typo_rate)}"
+    return text
+
+def corpus(items, texts, seed=0, typo_rate=0.1):
+    """``texts`` shopping lists of ``items`` items; the same for a given seed."""
+    rng = random.Random(f"{seed}:{items}")
+    return [shopping_list(rng, items, typo_rate) for _ in range(texts)]
+
+def synthetic_phrases(count, seed=0):
+    """``count`` made-up product phrases to grow the vocabulary with."""
+    rng = random.Random(f"{seed}:vocabulary")
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+
+    def word():
+        return "".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4)))
+
+    phrases = set()
+    while len(phrases) < count:
+        phrases.add(" ".join(word() for _ in range(rng.randint(1, 2))))
+    return sorted(phrases)
+
+def grown_vocabulary(extra_products, seed=0):
+    """The live vocabulary plus ``extra_products`` synthetic product phrases."""
+    base = app.VOCABULARY.current
+    if not extra_products:
+        return base
+    return CompiledVocabulary(
+        base.products + synthetic_phrases(extra_products, seed),
+        base.brands, base.colors, base.shade_to_root, base.threshold, base.tokenizers,
+    )
+
+# =========================
+# Timing
+# =========================
+def time_stages(text, vocab):
+    """Seconds spent in each stage for one text, then on the whole path."""
+    clock = time.perf_counter
+    t0 = clock()
+    tokens = app.my_word_tokenize(text)
+    t1 = clock()
+    product_matches, brand_matches, color_matches = app.match_keywords([tokens], vocab)[0]
+    t2 = clock()
+    product_matches, brand_matches, color_matches = app.resolve_matches(
+        product_matches, brand_matches, color_matches
+    )
+    t3 = clock()
+    products = []
+    t4 = t3
+    if product_matches:
+        quantity_matches, budget_matches = app.find_quantities_and_budgets(tokens)
+        products = app.attach_matches(
+            product_matches, brand_matches, color_matches, quantity_matches, budget_matches, vocab
+        )
+        t4 = clock()
+        products = app.merge_products(products)
+    t5 = clock()
+    app.save_query(text, {"products": products, "total_products": len(products)})
+    t6 = clock()
+    app.save_query(text, app.extract_products(text, vocab))
+    t7 = clock()
+    return {
+        "tokenize": t1 - t0,
+        "match": t2 - t1,
+        "resolve": t3 - t2,
+        "attach": t4 - t3,
+        "merge": t5 - t4,
+        "persist": t6 - t5,
+        "end_to_end": t7 - t6,
+    }
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_scenario(texts, vocab, repeat):
+    """Per-stage median and p95 (ms per text), taking each text's fastest of ``repeat`` runs."""
+    best = [dict.fromkeys(STAGES, float("inf")) for _ in texts]
+    for _ in range(repeat):
+        for fastest, text in zip(best, texts):
+            for stage, seconds in time_stages(text, vocab).items():
+                fastest[stage] = min(fastest[stage], seconds)
+    return {
+        stage: {
+            "median_ms": statistics.median(b[stage] for b in best) * 1000,
+            "p95_ms": percentile([b[stage] for b in best], 0.95) * 1000,
+        }
+        for stage in STAGES
+    }
+
+def run(config):
+    """Time every (items, vocab_size) scenario of ``config``."""
+    scenarios = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app.DB = ConnectionManager(os.path.join(tmp, "benchmark.db"))
+        app.init_database()
+        for vocab_size in config["vocab_sizes"]:
+            vocab = grown_vocabulary(vocab_size, config["seed"])
+            for items in config["items"]:
+                texts = corpus(items, config["texts"], config["seed"], config["typo_rate"])
+                scenarios.append({
+                    "items": items,
+                    "vocab_size": len(vocab.products),
+                    "extra_products": vocab_size,
+                    "stages": run_scenario(texts, vocab, config["repeat"]),
+                })
+        app.DB.close()
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "scenarios": scenarios,
+    }
+
+# =========================
+# HTTP throughput
+# =========================
+def post_until(args):
+    """Client process: post ``texts`` round-robin until ``deadline``; returns latencies."""
+    url, texts, deadline = args
+    latencies = []
+    i = 0
+    while time.time() < deadline:
+        body = json.dumps({"text": texts[i % len(texts)]}).encode()
+        req = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+        started = time.perf_counter()
+        with urllib.request.urlopen(req) as response:
+            response.read()
+        latencies.append(time.perf_counter() - started)
+        i += 1
+    return latencies
+
+def throughput(url, clients=8, seconds=10.0, items=10, seed=0, typo_rate=0.1):
+    texts = corpus(items, 2000, seed, typo_rate)
+    deadline = time.time() + seconds
+    started = time.perf_counter()
+    with multiprocessing.Pool(clients) as pool:
+        per_client = pool.map(post_until, [
+            (url.rstrip("/") + "/extract", texts[c::clients], deadline) for c in range(clients)
+        ])
+    elapsed = time.perf_counter() - started
+    latencies = [t for client in per_client for t in client]
+    return {
+        "url": url, "clients": clients, "items": items,
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+        },
+    }
+
+# =========================
+# Regression corpus
+# =========================
+def corpus_record(text, vocab):
+    """The tokens and verbose /extract response of ``text``, as recorded in the corpus."""
+    return {
+        "text": text,
+        "tokens": app.my_word_tokenize(text),
+        # Round-tripped so tuples compare equal to the lists read back
+        "response": json.loads(json.dumps(app.extract_products(text, vocab, verbose=True))),
+    }
+
+def check_corpus(path, update=False):
+    """Compare tokens, spans and responses with the corpus at ``path``
+    (re-recording it with ``update``); returns the number of failures."""
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    vocab = grown_vocabulary(0)
+    reference = SpanTokenizer(app.sentence_splitter, app.word_tokenizer, fast=False)
+    failures = changed = 0
+    records = []
+    for case in cases:
+        text = case["text"]
+        record = corpus_record(text, vocab)
+        records.append(record)
+        if app.my_word_spans(text) != reference.span_tokenize(text):
+            failures += 1
+            print(f"SPANS differ from Punkt + Treebank: {text[:70]!r}")
+        for key in ("tokens", "response"):
+            if record[key] != case[key]:
+                changed += 1
+                print(f"{key.upper()} changed: {text[:70]!r}")
+    if update:
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        print(f"re-recorded {len(records)} texts in {path}")
+    else:
+        failures += changed
+    print(f"{len(cases)} corpus texts, {failures} failures")
+    return failures
+
+# =========================
+# Reporting / regression check
+# =========================
+def print_results(results):
+    print(f"{'items':>6} {'vocab':>7}  " + "  ".join(f"{s:>16}" for s in STAGES))
+    for sc in results["scenarios"]:
+        cells = [f"{st['median_ms']:7.3f}/{st['p95_ms']:<8.3f}" for st in (sc["stages"][s] for s in STAGES)]
+        print(f"{sc['items']:>6} {sc['vocab_size']:>7}  " + "  ".join(f"{c:>16}" for c in cells))
+    print("(median/p95 ms per text)")
+
+def regressions(baseline, current, threshold, min_delta_ms):
+    """(items, vocab_size, stage, baseline_ms, current_ms) for every slowed-down stage median."""
+    before = {(sc["items"], sc["extra_products"]): sc for sc in baseline["scenarios"]}
+    found = []
+    for sc in current["scenarios"]:
+        old = before.get((sc["items"], sc["extra_products"]))
+        if old is None:
+            continue
+        for stage in STAGES:
+            was = old["stages"][stage]["median_ms"]
+            now = sc["stages"][stage]["median_ms"]
+            if now > was * (1 + threshold) and now - was > min_delta_ms:
+                found.append((sc["items"], sc["vocab_size"], stage, was, now))
+    return found
+
+def int_list(value):
+    return [int(n) for n in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the /extract pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="time every stage on the synthetic corpus")
+    p.add_argument("--items", type=int_list, default=[1, 10, 50, 100],
+                   help="comma-separated items per text (default: 1,10,50,100)")
+    p.add_argument("--vocab-sizes", type=int_list, default=[0, 5000],
+                   help="comma-separated synthetic products added to the vocabulary (default: 0,5000)")
+    p.add_argument("--texts", type=int, default=20, help="texts per scenario")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--typo-rate", type=float, default=0.1, help="chance of a typo per keyword word")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", help="also write the results to this JSON file")
+
+    p = sub.add_parser("compare", help="re-run a saved configuration and fail on regressions")
+    p.add_argument("baseline", help="JSON file written by 'run --output'")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="allowed slowdown of a stage median, as a fraction (default: %(default)s)")
+    p.add_argument("--min-delta-ms", type=float, default=0.05,
+                   help="ignore slowdowns smaller than this (default: %(default)s)")
+    p.add_argument("--output", help="also write the new results to this JSON file")
+
+    p = sub.add_parser("corpus", help="print synthetic texts, one per line")
+    p.add_argument("--items", type=int, default=10)
+    p.add_argument("--texts", type=int, default=10)
+    p.add_argument("--typo-rate", type=float, default=0.1)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("throughput", help="requests/s against a running server")
+    p.add_argument("--url", default="http://127.0.0.1:5000")
+    p.add_argument("--clients", type=int, default=8, help="concurrent client processes")
+    p.add_argument("--seconds", type=float, default=10.0)
+    p.add_argument("--items", type=int, default=10)
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("check", help="compare tokens and responses with the regression corpus")
+    p.add_argument("--corpus", default=REGRESSION_CORPUS)
+    p.add_argument("--update", action="store_true", help="re-record the corpus from the current code")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        sys.exit(1 if check_corpus(args.corpus, args.update) else 0)
+
+    if args.command == "throughput":
+        print(json.dumps(throughput(args.url, args.clients, args.seconds, args.items, args.seed), indent=2))
+        sys.exit(0)
+
+    if args.command == "corpus":
+        for text in corpus(args.items, args.texts, args.seed, args.typo_rate):
+            print(text)
+        sys.exit(0)
+
+    if args.command == "run":
+        config = {
+            "items": args.items, "vocab_sizes": args.vocab_sizes, "texts": args.texts,
+            "repeat": args.repeat, "typo_rate": args.typo_rate, "seed": args.seed,
+        }
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        config = baseline["config"]
+
+    results = run(config)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.command == "compare":
+        found = regressions(baseline, results, args.threshold, args.min_delta_ms)
+        for items, vocab_size, stage, was, now in found:
+            print(f"REGRESSION items={items} vocab={vocab_size} {stage}: "
+                  f"{was:.3f} ms -> {now:.3f} ms (+{(now / was - 1) * 100:.0f}%)")
+        if found:
+            sys.exit(1)
+        print(f"no stage slower than {args.threshold:.0%} over baseline")
@@ -0,0 +1,392 @@
+import os
+import sqlite3
+import threading
+
+from payloads import copy_queries_to_payloads
+
+# PRAGMAs applied to every new connection. journal_mode=WAL lets readers
+# (/history) run alongside the query-log writer; synchronous=NORMAL is
+# durable across application crashes in WAL mode and avoids an fsync per
+# commit. auto_vacuum=INCREMENTAL (effective for new databases; see
+# archive.enable_incremental_vacuum for existing ones) lets retention hand
+# freed pages back in small steps instead of a locking VACUUM.
+DEFAULT_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,        # KiB (negative) -> ~20 MB page cache
+    "mmap_size": 268435456,      # 256 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,        # ms
+    "foreign_keys": "ON",
+}
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+# =========================
+# Analytics rollups
+# =========================
+# Per-hour and per-day counts of queries and of the queries naming each
+# product, brand, color and budget band (lower edges below, in the
+# response's currency). The bands are baked into migration 5's trigger;
+# changing them needs a new migration that recreates it, then
+# `python app.py --rebuild-rollups`.
+BUDGET_BANDS = [0, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000]
+
+ROLLUP_GRANULARITIES = {"hour": "strftime('%Y-%m-%d %H:00:00', {})", "day": "date({})"}
+
+def budget_band_sql(expr):
+    """SQL CASE naming the BUDGET_BANDS band of ``expr`` ("500-999", "100000+")."""
+    whens = " ".join(
+        f"WHEN {expr} < {upper} THEN '{lower}-{upper - 1}'"
+        for lower, upper in zip(BUDGET_BANDS, BUDGET_BANDS[1:])
+    )
+    return f"CASE {whens} ELSE '{BUDGET_BANDS[-1]}+' END"
+
+# (dimension, source table, counted column)
+ROLLUP_SOURCES = [
+    ("queries", "queries", None),
+    ("product", "query_products", "product"),
+    ("brand", "query_brands", "brand"),
+    ("color", "query_colors", "color"),
+    ("budget", "query_budgets", "budget"),
+]
+
+def rollup_value_sql(dimension, column):
+    """SQL for the rollup value of ``column`` (an expression) in ``dimension``."""
+    if column is None:
+        return "''"
+    if dimension == "budget":
+        return budget_band_sql(column)
+    return column
+
+def rollup_rebuild_statements(since=False):
+    """Statements recomputing the rollups from the raw history. With
+    ``since``, they take one parameter, a created_at string, and only
+    touch the buckets from its day onwards."""
+    where = "AND created_at >= date(?)" if since else ""
+    statements = ["DELETE FROM rollups WHERE bucket >= date(?)" if since else "DELETE FROM rollups"]
+    for granularity, bucket in ROLLUP_GRANULARITIES.items():
+        for dimension, table, column in ROLLUP_SOURCES:
+            statements.append(f'''
+                INSERT INTO rollups (dimension, granularity, bucket, value, count)
+                SELECT '{dimension}', '{granularity}', {bucket.format("created_at")},
+                       {rollup_value_sql(dimension, column)}, COUNT(*)
+                FROM {table}
+                WHERE created_at IS NOT NULL {where}
+                GROUP BY 3, 4
+            ''')
+    return statements
+
+def rollup_trigger(dimension, table, column):
+    value = rollup_value_sql(dimension, column and f"NEW.{column}")
+    upserts = "".join(
+        f'''
+            INSERT INTO rollups (dimension, granularity, bucket, value, count)
+            VALUES ('{dimension}', '{granularity}', {bucket.format("NEW.created_at")}, {value}, 1)
+            ON CONFLICT (dimension, granularity, bucket, value) DO UPDATE SET count = count + 1;'''
+        for granularity, bucket in ROLLUP_GRANULARITIES.items()
+    )
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS rollup_{dimension}_insert AFTER INSERT ON {table}
+        WHEN NEW.created_at IS NOT NULL
+        BEGIN{upserts}
+        END
+    '''
+
+def rebuild_rollups(conn, since=None):
+    """Recompute the rollups from the raw history in one transaction, from
+    the day of ``since`` (a created_at string) onwards when given.
+
+    Counts are only ever added as rows are inserted, so they survive
+    deletes from ``queries``; a rebuild drops the counts of deleted rows.
+    """
+    params = (since,) if since else ()
+    with conn:
+        for statement in rollup_rebuild_statements(since=bool(since)):
+            conn.execute(statement, params)
+
+# =========================
+# Query-log triggers
+# =========================
+# Keep the side tables and queries_fts (migration 4) in step with queries.
+# Rows written with a shared payload (migration 6) instead of inline JSON
+# get their side-table rows from insert_query_terms().
+QUERIES_TERMS_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS queries_terms_insert AFTER INSERT ON queries
+    WHEN json_valid(NEW.extracted_json)
+    BEGIN
+        INSERT OR IGNORE INTO query_products (query_id, product, created_at)
+            SELECT NEW.id, json_extract(p.value, '$.product'), NEW.created_at
+            FROM json_each(NEW.extracted_json, '$.products') AS p;
+        INSERT OR IGNORE INTO query_brands (query_id, brand, created_at)
+            SELECT NEW.id, v.value, NEW.created_at
+            FROM json_each(NEW.extracted_json, '$.products') AS p, json_each(p.value, '$.brands') AS v;
+        INSERT OR IGNORE INTO query_colors (query_id, color, created_at)
+            SELECT NEW.id, v.value, NEW.created_at
+            FROM json_each(NEW.extracted_json, '$.products') AS p, json_each(p.value, '$.colors') AS v;
+        INSERT OR IGNORE INTO query_budgets (query_id, budget, created_at)
+            SELECT NEW.id, v.value, NEW.created_at
+            FROM json_each(NEW.extracted_json, '$.products') AS p, json_each(p.value, '$.budgets') AS v;
+    END
+'''
+
+QUERIES_FTS_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS queries_fts_insert AFTER INSERT ON queries
+    BEGIN
+        INSERT INTO queries_fts (rowid, raw_text) VALUES (NEW.id, NEW.raw_text);
+    END
+'''
+
+QUERIES_DELETE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS queries_index_delete AFTER DELETE ON queries
+    BEGIN
+        DELETE FROM query_products WHERE query_id = OLD.id;
+        DELETE FROM query_brands WHERE query_id = OLD.id;
+        DELETE FROM query_colors WHERE query_id = OLD.id;
+        DELETE FROM query_budgets WHERE query_id = OLD.id;
+        INSERT INTO queries_fts (queries_fts, rowid, raw_text) VALUES ('delete', OLD.id, OLD.raw_text);
+    END
+'''
+
+# (side table, column, product field) of each side table; the product
+# field is a list, except "product" itself
+QUERY_TERM_TABLES = [
+    ("query_products", "product", "product"),
+    ("query_brands", "brand", "brands"),
+    ("query_colors", "color", "colors"),
+    ("query_budgets", "budget", "budgets"),
+]
+
+def insert_query_terms(conn, queries):
+    """Side-table rows for (query_id, created_at, result) triples, the
+    same rows QUERIES_TERMS_TRIGGER derives from inline JSON."""
+    for table, column, field in QUERY_TERM_TABLES:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {table} (query_id, {column}, created_at) VALUES (?, ?, ?)",
+            [
+                (query_id, value, created_at)
+                for query_id, created_at, result in queries
+                for product in result.get("products", [])
+                for value in ([product[field]] if field == "product" else product[field])
+            ],
+        )
+
+# =========================
+# Schema migrations
+# =========================
+# Applied in order; PRAGMA user_version records the last one applied. A
+# step is an SQL statement or a callable taking the connection.
+MIGRATIONS = [
+    # 1: query log
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            raw_text TEXT NOT NULL,
+            extracted_json TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 2: /history reads the newest rows by created_at
+    [
+        "CREATE INDEX IF NOT EXISTS idx_queries_created_at ON queries(created_at)",
+    ],
+    # 3: runtime-editable keyword vocabulary (VOCABULARY_SOURCE=sqlite:...)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS vocabulary (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL CHECK (kind IN ('product', 'brand', 'color', 'shade')),
+            phrase TEXT NOT NULL,
+            root TEXT
+        )
+        ''',
+    ],
+    # 4: /history filters. Side tables hold each query's distinct products,
+    # brands, colors and budgets (with created_at, so a filter plus a time
+    # range is one index range), queries_fts indexes raw_text. Triggers keep
+    # both in step with queries; existing rows are backfilled.
+    [
+        *[
+            f'''
+            CREATE TABLE IF NOT EXISTS query_{table} (
+                query_id INTEGER NOT NULL,
+                {column} {kind} NOT NULL,
+                created_at TIMESTAMP,
+                PRIMARY KEY (query_id, {column})
+            ) WITHOUT ROWID
+            '''
+            for table, column, kind in [("products", "product", "TEXT"), ("brands", "brand", "TEXT"),
+                                        ("colors", "color", "TEXT"), ("budgets", "budget", "INTEGER")]
+        ],
+        "CREATE INDEX IF NOT EXISTS idx_query_products_product ON query_products(product, created_at, query_id)",
+        "CREATE INDEX IF NOT EXISTS idx_query_brands_brand ON query_brands(brand, created_at, query_id)",
+        "CREATE INDEX IF NOT EXISTS idx_query_colors_color ON query_colors(color, created_at, query_id)",
+        "CREATE INDEX IF NOT EXISTS idx_query_budgets_budget ON query_budgets(budget, created_at, query_id)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS queries_fts USING fts5(raw_text, content='queries', content_rowid='id')",
+        QUERIES_TERMS_TRIGGER,
+        QUERIES_FTS_TRIGGER,
+        QUERIES_DELETE_TRIGGER,
+        '''
+        INSERT OR IGNORE INTO query_products (query_id, product, created_at)
+            SELECT q.id, json_extract(p.value, '$.product'), q.created_at
+            FROM queries AS q, json_each(q.extracted_json, '$.products') AS p
+            WHERE json_valid(q.extracted_json)
+        ''',
+        *[
+            f'''
+            INSERT OR IGNORE INTO query_{table} (query_id, {column}, created_at)
+                SELECT q.id, v.value, q.created_at
+                FROM queries AS q, json_each(q.extracted_json, '$.products') AS p, json_each(p.value, '$.{table}') AS v
+                WHERE json_valid(q.extracted_json)
+            '''
+            for table, column in [("brands", "brand"), ("colors", "color"), ("budgets", "budget")]
+        ],
+        "INSERT INTO queries_fts (queries_fts) VALUES ('rebuild')",
+    ],
+    # 5: /stats rollups, maintained by triggers on queries and the side
+    # tables of migration 4
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS rollups (
+            dimension TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (dimension, granularity, bucket, value)
+        ) WITHOUT ROWID
+        ''',
+        *[rollup_trigger(*source) for source in ROLLUP_SOURCES],
+        *rollup_rebuild_statements(),
+    ],
+    # 6: shared, compressed result payloads (see payloads.py). queries is
+    # rebuilt with a nullable extracted_json, each row's JSON moving into
+    # its payload on the way; `python app.py --migrate` reports the space.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS payloads (
+            id INTEGER PRIMARY KEY,
+            digest BLOB NOT NULL UNIQUE,
+            encoding TEXT NOT NULL,
+            body BLOB NOT NULL
+        )
+        ''',
+        # Left behind by an interrupted run of this migration before it was
+        # made atomic
+        "DROP TABLE IF EXISTS queries_v6",
+        '''
+        CREATE TABLE queries_v6 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            raw_text TEXT NOT NULL,
+            extracted_json TEXT,
+            payload_id INTEGER REFERENCES payloads(id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CHECK ((extracted_json IS NULL) <> (payload_id IS NULL))
+        )
+        ''',
+        lambda conn: copy_queries_to_payloads(conn, "queries_v6"),
+        # Keep AUTOINCREMENT from reusing the ids of deleted (archived) rows
+        "DELETE FROM sqlite_sequence WHERE name = 'queries_v6'",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'queries_v6', seq FROM sqlite_sequence WHERE name = 'queries'",
+        "DROP TABLE queries",
+        "ALTER TABLE queries_v6 RENAME TO queries",
+        "CREATE INDEX IF NOT EXISTS idx_queries_created_at ON queries(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_queries_payload_id ON queries(payload_id)",
+        QUERIES_TERMS_TRIGGER,
+        QUERIES_FTS_TRIGGER,
+        QUERIES_DELETE_TRIGGER,
+        rollup_trigger(*ROLLUP_SOURCES[0]),
+    ],
+]
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply pending migrations; returns the resulting schema version.
+
+    Each migration is one explicit transaction: sqlite3 only opens one
+    implicitly before DML, so its DDL would otherwise commit on its own and
+    a failed step could leave half a migration behind. BEGIN IMMEDIATE also
+    serializes processes migrating the same file, since each re-reads
+    user_version once it holds the write lock.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(migrations):
+                    conn.execute("COMMIT")
+                    return version
+                for statement in migrations[version]:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+
+# =========================
+# Connection manager
+# =========================
+class ConnectionManager:
+    """Keeps one tuned SQLite connection per thread (and per process).
+
+    Connections are opened lazily, configured with ``pragmas`` and reused
+    for the life of the thread, so sqlite3's statement cache keeps the
+    compiled INSERT/SELECT statements across calls. With ``migrations``,
+    the first connection of each process applies the pending ones, so the
+    schema is current however the app was started.
+    """
+
+    def __init__(self, path, pragmas=None, migrations=None):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.migrations = migrations
+        self._local = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._migrated_pid = None
+
+    def connection(self):
+        """The calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        # A connection inherited across fork() must not be reused
+        conn = sqlite3.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.migrations is not None:
+            try:
+                self._migrate(conn)
+            except BaseException:
+                conn.close()
+                raise
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _migrate(self, conn):
+        # One thread per process migrates; the others wait for it rather
+        # than for the write lock (which busy_timeout bounds)
+        with self._migrate_lock:
+            if self._migrated_pid != os.getpid():
+                migrate(conn, self.migrations)
+                self._migrated_pid = os.getpid()
+
+    def close(self):
+        """Close the calling thread's connection, if any."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
@@ -0,0 +1,260 @@
+"""Offline bulk extraction over archived utterances, without HTTP.
+
+    python extract_offline.py INPUT (--output results.jsonl | --sqlite results.db)
+                              [--workers N] [--chunk-size 500] [--checkpoint run.ckpt]
+
+INPUT is NDJSON (JSON strings or {"text": ..., "id": ...} objects) or CSV
+with a "text" column and an optional "id" column (chosen by the .csv
+extension or --format). Records are read CHUNK_SIZE at a time and fanned
+out to a process pool; the workers are forked after the vocabulary is
+loaded, so they share it copy-on-write.
+
+Results come back in input order. With --output each record becomes one
+JSON line, the same as a line of /extract/stream. With --sqlite it becomes
+a row of the ``results`` table, keyed by its line number, with the
+record's id (if it has one) in the ``id`` column; records sharing an id
+all keep their rows.
+
+With --checkpoint, progress is recorded after every written chunk. Running
+the same command again resumes after the last checkpointed record and
+truncates any output written after it. Progress goes to stderr every
+--progress-interval seconds, and a throughput summary is printed at the end.
+"""
+import os
+
+# Offline runs have no /metrics to serve; skip the stage timers
+os.environ.setdefault("METRICS_ENABLED", "0")
+
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import sqlite3
+import sys
+import time
+from collections import deque
+from itertools import islice
+
+import app
+
+CHUNK_SIZE = 500
+
+# Chunks queued per worker; bounds memory however large the input is
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# =========================
+# Input
+# =========================
+def read_records(path, fmt, skip=0):
+    """(line, id, text, error) records of ``path``, after the first ``skip``."""
+    f = open(path, encoding="utf-8", errors="replace", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        if "text" not in (reader.fieldnames or []):
+            raise SystemExit(f"{path}: CSV header has no 'text' column")
+        records = app.csv_records(reader, "text", "id")
+    else:
+        records = app.ndjson_records(f)
+    return islice(records, skip, None)
+
+def chunks(records, size):
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+# =========================
+# Workers
+# =========================
+def extract_chunk(args):
+    """Pool task: output dicts for one chunk of records."""
+    records, verbose = args
+    outputs, _ = app.extract_records(records, app.VOCABULARY.current, verbose)
+    return outputs
+
+# =========================
+# Output
+# =========================
+class JsonlSink:
+    def __init__(self, path, resume_offset=None):
+        self.f = open(path, "r+b" if resume_offset is not None else "wb")
+        if resume_offset is not None:
+            # Drop whatever was written after the checkpoint
+            self.f.truncate(resume_offset)
+            self.f.seek(resume_offset)
+
+    @staticmethod
+    def can_resume(path, resume_offset):
+        """Whether ``path`` still holds everything up to the checkpoint."""
+        return os.path.isfile(path) and os.path.getsize(path) >= resume_offset
+
+    def write(self, outputs):
+        self.f.write("".join(json.dumps(out) + "\n" for out in outputs).encode())
+
+    def commit(self):
+        """Make everything written so far durable; returns the resume position."""
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+class SqliteSink:
+    COLUMNS = ["line", "id", "extracted_json", "error"]
+
+    def __init__(self, path, resume_offset=None):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.records = resume_offset or 0
+        if resume_offset is None:
+            # A fresh run replaces earlier results, as JsonlSink does
+            self.conn.execute("DROP TABLE IF EXISTS results")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                line INTEGER PRIMARY KEY,
+                id TEXT,
+                extracted_json TEXT,
+                error TEXT
+            )
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_id ON results(id)")
+
+    @staticmethod
+    def can_resume(path, resume_offset):
+        """Whether ``path`` holds a results table in the current layout with
+        a row for every record up to the checkpoint."""
+        if resume_offset is None or not os.path.isfile(path):
+            return False
+        conn = sqlite3.connect(path)
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+            if columns != SqliteSink.COLUMNS:
+                return False
+            return conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] >= resume_offset
+        finally:
+            conn.close()
+
+    def write(self, outputs):
+        rows = []
+        for out in outputs:
+            result = {k: v for k, v in out.items() if k not in ("line", "id", "error")}
+            rows.append((out["line"], str(out["id"]) if "id" in out else None,
+                         None if "error" in out else json.dumps(result), out.get("error")))
+        # Replayed chunks after a resume overwrite their earlier rows (same
+        # lines); distinct records that share an id each keep their own
+        self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+        self.records += len(rows)
+
+    def commit(self):
+        """Commit the rows written so far; returns the resume position (records written)."""
+        self.conn.commit()
+        return self.records
+
+    def close(self):
+        self.conn.close()
+
+# =========================
+# Checkpoints
+# =========================
+def load_checkpoint(path, run):
+    """The saved checkpoint for this run, or None to start from scratch."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("run") != run:
+        raise SystemExit(f"{path} belongs to a different run: {checkpoint.get('run')}")
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# =========================
+# Driver
+# =========================
+def run(input_path, fmt, sink_kind, sink_path, workers, chunk_size=CHUNK_SIZE, verbose=False,
+        checkpoint_path=None, progress_interval=10.0, log=sys.stderr):
+    run_id = {"input": os.path.abspath(input_path), "sink": sink_kind,
+              "output": os.path.abspath(sink_path), "verbose": verbose}
+    checkpoint = load_checkpoint(checkpoint_path, run_id)
+    sink_class = JsonlSink if sink_kind == "jsonl" else SqliteSink
+    if checkpoint and not sink_class.can_resume(sink_path, checkpoint["output_offset"]):
+        print(f"{sink_path} is missing or does not match the checkpoint; starting over", file=log)
+        checkpoint = None
+    done = checkpoint["records"] if checkpoint else 0
+    sink = sink_class(sink_path, checkpoint["output_offset"] if checkpoint else None)
+    if checkpoint:
+        print(f"resuming after {done} records", file=log)
+
+    # Workers take an immutable snapshot; no watcher thread may be mid-reload at fork()
+    app.VOCABULARY.stop(timeout=app.VOCABULARY_POLL_INTERVAL)
+    gc.freeze()
+
+    stats = {"records": 0, "errors": 0, "products": 0}
+    started = last_report = time.perf_counter()
+    tasks = chunks(read_records(input_path, fmt, skip=done), chunk_size)
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        pending = deque()
+        for chunk in tasks:
+            pending.append(pool.apply_async(extract_chunk, ((chunk, verbose),)))
+            if len(pending) < workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                continue
+            done = write_next(pending, sink, stats, done, checkpoint_path, run_id)
+            now = time.perf_counter()
+            if now - last_report >= progress_interval:
+                last_report = now
+                print(f"{done} records, {stats['records'] / (now - started):.0f} records/s", file=log)
+        while pending:
+            done = write_next(pending, sink, stats, done, checkpoint_path, run_id)
+    sink.close()
+
+    elapsed = time.perf_counter() - started
+    return dict(stats, total_records=done, workers=workers, seconds=elapsed,
+                records_per_second=stats["records"] / elapsed if elapsed else 0.0)
+
+def write_next(pending, sink, stats, done, checkpoint_path, run_id):
+    """Write the oldest pending chunk (blocking until it is ready); returns records done."""
+    outputs = pending.popleft().get()
+    sink.write(outputs)
+    offset = sink.commit()
+    done += len(outputs)
+    stats["records"] += len(outputs)
+    for out in outputs:
+        if "error" in out:
+            stats["errors"] += 1
+        else:
+            stats["products"] += out["total_products"]
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, {"run": run_id, "records": done, "output_offset": offset})
+    return done
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract products from an NDJSON/CSV file of utterances.")
+    parser.add_argument("input")
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument("--output", help="write results to this JSONL file")
+    out.add_argument("--sqlite", help="write results to the 'results' table of this SQLite file")
+    parser.add_argument("--format", choices=["ndjson", "csv"],
+                        help="input format (default: csv for *.csv, else ndjson)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--verbose", action="store_true", help="include aliases_raw, positions and match_logs")
+    parser.add_argument("--checkpoint", help="checkpoint file for resuming an interrupted run")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "ndjson")
+    summary = run(
+        args.input, fmt,
+        "jsonl" if args.output else "sqlite", args.output or args.sqlite,
+        args.workers, args.chunk_size, args.verbose, args.checkpoint, args.progress_interval,
+    )
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,389 @@
+import math
+import threading
+from collections import Counter, namedtuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Character q-gram size for the candidate index. With FUZZY_THRESHOLD=70
+# the count bound for q >= 2 drops to "one shared gram" for most short
+# phrases; q=1 makes the bound exactly the LCS upper bound and prunes far
+# more.
+QGRAM_SIZE = 1
+# Windows filtered per matrix product (bounds temporary memory)
+INDEX_WINDOW_CHUNK = 32
+# Buckets with fewer phrases skip the filter: one cdist over the whole
+# bucket is cheaper than filtering it. Measured with benchmark.py's
+# synthetic lists and phrases: on 20-item lists the filter loses at 1,100
+# phrases of one token length (5.7 vs 3.3 ms) and wins from 2,600 (6.6 vs
+# 7.2 ms; 44 vs 70 ms at 20,000).
+INDEX_MIN_BUCKET_PHRASES = 2500
+
+# One keyword match: ``term`` is the matched text as written, spanning
+# tokens start_pos..end_pos (inclusive), ``matched_with`` the vocabulary
+# phrase. Tuple-backed, so candidates carry no per-instance dict.
+Match = namedtuple("Match", "term matched_with start_pos end_pos score type")
+
+# =========================
+# Q-gram candidate index
+# =========================
+def qgrams(s, q=QGRAM_SIZE):
+    """Multiset of the character q-grams of ``s``."""
+    return Counter(s[i:i + q] for i in range(len(s) - q + 1))
+
+def min_shared_qgrams(m, n, threshold, q=QGRAM_SIZE):
+    """Lower bound on shared q-grams for two strings of lengths m and n to
+    reach ``fuzz.ratio >= threshold``, or None if their lengths alone rule
+    it out.
+
+    ratio = 200 * LCS / (m + n), so a match needs an LCS of at least
+    ``lcs``. Every character of one string outside the LCS destroys at most
+    q of its q-grams, and every gap opened by the other string's extra
+    characters breaks at most q - 1 more.
+    """
+    lcs = math.ceil(threshold * (m + n) / 200 - 1e-9)
+    if lcs > min(m, n):
+        return None
+    from_n = (n - q + 1) - (n - lcs) * q - (m - lcs) * (q - 1)
+    from_m = (m - q + 1) - (m - lcs) * q - (n - lcs) * (q - 1)
+    return max(from_n, from_m, 0)
+
+class IndexBucket:
+    """All indexed phrases with the same token count.
+
+    ``levels`` is the inverted index proper: one 0/1 row per (q-gram,
+    level) pair, set for the phrases holding at least ``level`` copies of
+    the gram. Since min(a, b) counts the levels both reach, the q-grams a
+    batch of windows shares with every phrase is one matrix product over
+    the rows the windows touch.
+    """
+
+    def __init__(self, pids, phrases, q):
+        self.pids = pids
+        self.phrases = np.array(phrases, dtype=object)
+        self.lengths = np.array([len(p) for p in phrases], dtype=np.int32)
+        self.level_ids = {}
+        cells = []
+        for col, phrase in enumerate(phrases):
+            for gram, count in qgrams(phrase, q).items():
+                for level in range(1, count + 1):
+                    cells.append((self.level_ids.setdefault((gram, level), len(self.level_ids)), col))
+        self.levels = np.zeros((len(self.level_ids), len(phrases)), dtype=np.float32)
+        if cells:
+            rows, cols = zip(*cells)
+            self.levels[rows, cols] = 1
+        self.needs = {}
+
+    def same_phrases(self, phrases):
+        return len(phrases) == len(self.phrases) and self.phrases.tolist() == phrases
+
+    def with_pids(self, pids):
+        """This bucket renumbered for another index; the level rows are
+        read-only and shared."""
+        bucket = object.__new__(IndexBucket)
+        bucket.__dict__.update(self.__dict__)
+        bucket.pids = pids
+        return bucket
+
+class Candidates:
+    """Candidate phrases for a batch of token lists, grouped by window
+    token length."""
+
+    def __init__(self, size):
+        self.size = size        # number of token lists in the batch
+        self.windows = {}       # length -> [window strings]
+        self.spans = {}         # length -> [(token list, start pos) per window]
+        self.pairs = {}         # length -> (window rows, bucket columns) that passed the filters;
+                                # lengths missing here are scored against the whole bucket
+        self.considered = 0     # window/phrase pairs a full scan would score
+
+class QGramIndex:
+    """Inverted index from character q-grams to vocabulary phrases.
+
+    One index is shared by every vocabulary: phrases are deduplicated
+    (lowercased) into pids, and each PhraseMatcher maps its own phrases
+    onto those pids. ``candidates()`` applies a length filter and the
+    q-gram count filter from ``min_shared_qgrams`` so a window is only
+    scored against phrases that can still reach the threshold. Buckets
+    under INDEX_MIN_BUCKET_PHRASES are left unfiltered.
+
+    Passing the ``previous`` index (same threshold and q) rebuilds
+    incrementally: buckets whose phrases are unchanged are reused as-is.
+    Its counters carry over either way, so they only ever grow.
+    """
+
+    def __init__(self, vocabularies, threshold, q=QGRAM_SIZE, previous=None):
+        self.threshold = threshold
+        self.q = q
+        self.phrases = []
+        self.pid_of = {}
+
+        for phrases in vocabularies:
+            for phrase in phrases:
+                lowered = phrase.lower()
+                if lowered not in self.pid_of:
+                    self.pid_of[lowered] = len(self.phrases)
+                    self.phrases.append(lowered)
+
+        self._lock = threading.Lock()
+        counted = previous.stats() if previous is not None else {}
+        self._stats = {key: counted.get(key, 0) for key in ("requests", "considered", "scored")}
+
+        by_length = {}
+        for pid, phrase in enumerate(self.phrases):
+            by_length.setdefault(len(phrase.split()), []).append(pid)
+        if previous is not None and (previous.threshold, previous.q) != (threshold, q):
+            previous = None
+        self.buckets = {}
+        self.reused_buckets = 0
+        for tok_len, pids in by_length.items():
+            phrases = [self.phrases[pid] for pid in pids]
+            old = previous.buckets.get(tok_len) if previous is not None else None
+            if old is not None and old.same_phrases(phrases):
+                self.buckets[tok_len] = old.with_pids(pids)
+                self.reused_buckets += 1
+            else:
+                self.buckets[tok_len] = IndexBucket(pids, phrases, q)
+        # pid -> (token length, column in that bucket)
+        self.position = {}
+        for tok_len, bucket in self.buckets.items():
+            for col, pid in enumerate(bucket.pids):
+                self.position[pid] = (tok_len, col)
+
+    def __getstate__(self):
+        # Locks cannot be pickled; counters start fresh in the loader
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_stats"] = {"requests": 0, "considered": 0, "scored": 0}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _needs(self, bucket, m):
+        """Shared-q-gram requirement of every bucket phrase for an m-char
+        window; phrases ruled out by length get an unreachable value."""
+        need = bucket.needs.get(m)
+        if need is None:
+            table = {}
+            for n in np.unique(bucket.lengths).tolist():
+                k = min_shared_qgrams(m, n, self.threshold, self.q)
+                table[n] = np.inf if k is None else k
+            need = np.array([table[n] for n in bucket.lengths.tolist()], dtype=np.float32)
+            bucket.needs[m] = need
+        return need
+
+    def candidates(self, tokens):
+        """Build the candidate pairs for every token window of ``tokens``."""
+        return self.candidates_batch([tokens])
+
+    def candidates_batch(self, token_lists):
+        """Build the candidate pairs for every token window of every list.
+
+        Windows never cross list boundaries; windows of the same token
+        length from the whole batch are filtered together.
+        """
+        lowered_lists = [[t.lower() for t in tokens] for tokens in token_lists]
+        result = Candidates(len(token_lists))
+        for tok_len, bucket in self.buckets.items():
+            windows, spans = [], []
+            for t, lowered in enumerate(lowered_lists):
+                for i in range(len(lowered) - tok_len + 1):
+                    windows.append(" ".join(lowered[i:i + tok_len]))
+                    spans.append((t, i))
+            if not windows:
+                continue
+            result.windows[tok_len] = windows
+            result.spans[tok_len] = spans
+            result.considered += len(windows) * len(bucket.pids)
+            if len(bucket.pids) >= INDEX_MIN_BUCKET_PHRASES:
+                result.pairs[tok_len] = self._filter(bucket, windows)
+
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["considered"] += result.considered
+        return result
+
+    def _filter(self, bucket, windows):
+        """(window rows, bucket columns) of the pairs passing both filters."""
+        rows, cols = [], []
+        for start in range(0, len(windows), INDEX_WINDOW_CHUNK):
+            chunk = windows[start:start + INDEX_WINDOW_CHUNK]
+            # Only the level rows some window of the chunk touches
+            used, cells = {}, []
+            for w, window in enumerate(chunk):
+                for gram, count in qgrams(window, self.q).items():
+                    for level in range(1, count + 1):
+                        lid = bucket.level_ids.get((gram, level))
+                        if lid is None:
+                            break
+                        cells.append((w, used.setdefault(lid, len(used))))
+            if cells:
+                touched = np.zeros((len(chunk), len(used)), dtype=np.float32)
+                w, u = zip(*cells)
+                touched[w, u] = 1
+                shared = touched @ bucket.levels[list(used)]
+            else:
+                shared = np.zeros((len(chunk), len(bucket.pids)), dtype=np.float32)
+            need = np.stack([self._needs(bucket, len(window)) for window in chunk])
+            w, c = np.nonzero(shared >= need)
+            rows.append(w + start)
+            cols.append(c)
+        return np.concatenate(rows), np.concatenate(cols)
+
+    def count_scored(self, pairs):
+        """Record ``pairs`` window/phrase pairs scored by a matcher."""
+        with self._lock:
+            self._stats["scored"] += pairs
+
+    def stats(self):
+        """Cumulative window/phrase pairs: ``considered`` by a full scan
+        vs actually ``scored`` by the matchers sharing the index."""
+        with self._lock:
+            return dict(self._stats, phrases=len(self.phrases))
+
+# =========================
+# Precompiled phrase matcher
+# =========================
+class PhraseMatcher:
+    """Fuzzy-matches token windows against a fixed phrase list.
+
+    Phrases are lowercased and grouped by token length once. Without an
+    index, a request scores all windows of a given length against all
+    phrases of that length in a single rapidfuzz ``cdist`` call; with a
+    ``QGramIndex`` each window is only scored against the phrases that
+    survived the index filters for it, in one ``cpdist`` call over those
+    pairs.
+    """
+
+    def __init__(self, phrases, type_, threshold, index=None):
+        self.type_ = type_
+        self.threshold = threshold
+        self.phrases = list(phrases)
+        self.index = index
+
+        # length -> (unique lowered phrases, [original indices per phrase])
+        buckets = {}
+        for idx, phrase in enumerate(self.phrases):
+            lowered = phrase.lower()
+            length = len(lowered.split())
+            choices, owners = buckets.setdefault(length, ([], {}))
+            if lowered not in owners:
+                owners[lowered] = []
+                choices.append(lowered)
+            owners[lowered].append(idx)
+
+        self.buckets = {
+            length: (choices, [owners[c] for c in choices])
+            for length, (choices, owners) in buckets.items()
+        }
+        # Longest phrase in tokens: the lookahead a window of tokens needs
+        self.max_tokens = max(self.buckets, default=0)
+        # matched_with -> its first index in ``phrases``. match_batch() orders
+        # matches by (phrase index, start); windowed extraction uses this to
+        # restore that order across windows.
+        self.rank = {}
+        for idx, phrase in enumerate(self.phrases):
+            self.rank.setdefault(phrase, idx)
+
+        # token length -> (bool mask over the index bucket, column -> indices)
+        self.own = {}
+        if index is not None:
+            for length, (choices, owners) in self.buckets.items():
+                bucket = index.buckets[length]
+                mask = np.zeros(len(bucket.pids), dtype=bool)
+                columns = {}
+                for lowered, idxs in zip(choices, owners):
+                    _, col = index.position[index.pid_of[lowered]]
+                    mask[col] = True
+                    columns[col] = idxs
+                self.own[length] = (mask, columns)
+
+    def match(self, tokens, candidates=None):
+        """Return Match records in the same order as a phrase-by-phrase scan."""
+        return self.match_batch([tokens], candidates)[0]
+
+    def match_batch(self, token_lists, candidates=None):
+        """Match every token list, scoring the whole batch together.
+
+        Returns one match list per token list, each ordered as
+        ``match()`` would order it.
+        """
+        if candidates is None and self.index is not None:
+            candidates = self.index.candidates_batch(token_lists)
+        if candidates is not None:
+            hits = self._score_candidates(candidates)
+        else:
+            hits = self._score_all(token_lists)
+
+        hits.sort(key=lambda h: (h[0], h[1], h[2]))
+        results = [[] for _ in token_lists]
+        for t, idx, i, length, score in hits:
+            tokens = token_lists[t]
+            results[t].append(Match(
+                " ".join(tokens[i:i + length]), self.phrases[idx], i, i + length - 1, score, self.type_
+            ))
+        return results
+
+    def _score_all(self, token_lists):
+        lowered_lists = [[t.lower() for t in tokens] for tokens in token_lists]
+        hits = []
+        for length in self.buckets:
+            windows, spans = [], []
+            for t, lowered in enumerate(lowered_lists):
+                for i in range(len(lowered) - length + 1):
+                    windows.append(" ".join(lowered[i:i + length]))
+                    spans.append((t, i))
+            if windows:
+                self._score_bucket(windows, spans, length, hits)
+        return hits
+
+    def _score_bucket(self, windows, spans, length, hits):
+        """Score ``windows`` against every phrase of ``length`` tokens."""
+        choices, owners = self.buckets[length]
+        scores = process.cdist(
+            windows, choices,
+            scorer=fuzz.ratio,
+            score_cutoff=self.threshold,
+            dtype=np.float64,
+        )
+        for w, c in zip(*np.nonzero(scores)):
+            t, i = spans[w]
+            score = float(scores[w, c])
+            for idx in owners[c]:
+                hits.append((t, idx, i, length, score))
+        return scores.size
+
+    def _score_candidates(self, candidates):
+        hits = []
+        scored = 0
+        for length, windows in candidates.windows.items():
+            if length not in self.own:
+                continue
+            spans = candidates.spans[length]
+            pairs = candidates.pairs.get(length)
+            if pairs is None:
+                scored += self._score_bucket(windows, spans, length, hits)
+                continue
+            own_mask, columns = self.own[length]
+            rows, cols = pairs
+            keep = own_mask[cols]
+            rows, cols = rows[keep], cols[keep]
+            if not rows.size:
+                continue
+            scores = process.cpdist(
+                [windows[w] for w in rows.tolist()],
+                self.index.buckets[length].phrases[cols].tolist(),
+                scorer=fuzz.ratio,
+                score_cutoff=self.threshold,
+                dtype=np.float64,
+            )
+            scored += scores.size
+            for k in np.flatnonzero(scores).tolist():
+                t, i = spans[rows[k]]
+                score = float(scores[k])
+                for idx in columns[int(cols[k])]:
+                    hits.append((t, idx, i, length, score))
+        self.index.count_scored(scored)
+        return hits
@@ -0,0 +1,275 @@
+import functools
+import glob
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows: each process reports only its own metrics
+    fcntl = None
+
+# Upper bounds (seconds) for latency histograms; +Inf is implicit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Seconds between a process's snapshots when metrics are shared (see
+# MetricsRegistry.share); a scrape sees other processes this far behind
+SHARE_INTERVAL = 1.0
+
+# Kinds whose totals outlive the process that counted them
+CUMULATIVE_KINDS = ("counter", "histogram")
+
+# =========================
+# Metric types
+# =========================
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label-value tuple."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in values]
+
+class Histogram:
+    """Cumulative-bucket histogram per label-value tuple."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        out = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                out.append((self.name + "_bucket", _format_labels(self.labels, key, le), cumulative))
+            out.append((self.name + "_sum", _format_labels(self.labels, key), total))
+            out.append((self.name + "_count", _format_labels(self.labels, key), cumulative))
+        return out
+
+class Collector:
+    """Values read from ``read()`` at scrape time, for state that is already
+    counted elsewhere (cache and query-log stats). ``read`` returns
+    {label-value tuple: value}."""
+
+    def __init__(self, name, help, kind, read, labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.read = read
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels, key), value)
+                for key, value in sorted(self.read().items())]
+
+# =========================
+# Registry
+# =========================
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text format.
+
+    A disabled registry still hands out metrics, but ``timed`` returns
+    functions unwrapped, so instrumentation applied through it costs
+    nothing; callers check ``enabled`` before recording anything else.
+
+    After ``share()``, render() reports the sum over every process forked
+    from the sharing one rather than just the process that answers.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+        self.shared_dir = None
+        self._sharer = None
+        self._sharer_pid = None
+        self._flush_lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, help, kind, read, labels=()):
+        return self.register(Collector(name, help, kind, read, labels))
+
+    def timed(self, histogram, labels=()):
+        """Decorator observing each call's duration in ``histogram``."""
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, labels)
+            return wrapper
+        return decorate
+
+    def render(self):
+        if self.shared_dir is not None:
+            samples = self._merged()
+        else:
+            samples = {metric.name: metric.samples() for metric in self._metrics}
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples[metric.name])
+        return "\n".join(lines) + "\n"
+
+    # -------------------------
+    # Sharing across processes
+    # -------------------------
+    # Each process writes <pid>.json, a snapshot of its samples, to the
+    # shared directory; a scrape sums them all, its own freshly written.
+    # When a process has exited, retire() folds its counters and histograms
+    # into retired.json, so totals never go backwards, and drops its gauges.
+    # Readers hold a shared lock on .lock, retire() an exclusive one.
+    def share(self, directory):
+        """Aggregate over the processes forked after this call, which must
+        each run ``start_sharing()``; ``directory`` holds their snapshots."""
+        if fcntl is None:
+            raise RuntimeError("sharing metrics across processes needs fcntl (POSIX only)")
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+
+    def start_sharing(self, interval=SHARE_INTERVAL):
+        """Snapshot this process's metrics every ``interval`` seconds
+        (idempotent; call again in a forked child)."""
+        if self.shared_dir is None or self._sharer_pid == os.getpid():
+            return
+        self._sharer_pid = os.getpid()
+        self._sharer = threading.Thread(target=self._share_loop, args=(interval,), name="metrics-sharer", daemon=True)
+        self._sharer.start()
+
+    def flush(self):
+        """Write this process's snapshot now (a worker's last one before it exits)."""
+        if self.shared_dir is None:
+            return
+        path = os.path.join(self.shared_dir, f"{os.getpid()}.json")
+        with self._flush_lock:
+            # Taken under the lock, so an older snapshot never replaces a newer one
+            snapshot = {metric.name: metric.samples() for metric in self._metrics}
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+
+    def retire(self, pid):
+        """Fold the snapshot of exited process ``pid`` into the retired totals."""
+        if self.shared_dir is None:
+            return
+        path = os.path.join(self.shared_dir, f"{pid}.json")
+        retired_path = os.path.join(self.shared_dir, "retired.json")
+        kinds = {metric.name: metric.kind for metric in self._metrics}
+        with self._locked(fcntl.LOCK_EX):
+            snapshot = self._read(path)
+            if snapshot is None:
+                return
+            cumulative = {name: rows for name, rows in snapshot.items() if kinds.get(name) in CUMULATIVE_KINDS}
+            merged = _sum_samples({}, [self._read(retired_path) or {}, cumulative])
+            with open(retired_path + ".tmp", "w") as f:
+                json.dump(merged, f)
+            os.replace(retired_path + ".tmp", retired_path)
+            os.remove(path)
+
+    def _share_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError:
+                pass   # the directory is gone: the server is shutting down
+
+    def _merged(self):
+        # Report this process from the snapshot it writes now, never from
+        # live values: a later scrape answered by another process reads that
+        # snapshot, so no total it reports can be lower than this one
+        self.flush()
+        with self._locked(fcntl.LOCK_SH):
+            snapshots = [self._read(path) for path in glob.glob(os.path.join(self.shared_dir, "*.json"))]
+        return _sum_samples({metric.name: [] for metric in self._metrics}, [s for s in snapshots if s])
+
+    def _locked(self, operation):
+        lock = open(os.path.join(self.shared_dir, ".lock"), "a")
+        fcntl.flock(lock, operation)
+        return lock   # closing the file releases the lock
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+def _sum_samples(samples, snapshots):
+    """``samples`` plus every snapshot, summed per (sample name, labels);
+    both map a metric name to [(sample name, labels, value)]."""
+    merged = {name: {(sample, labels): value for sample, labels, value in rows}
+              for name, rows in samples.items()}
+    for snapshot in snapshots:
+        for name, rows in snapshot.items():
+            series = merged.setdefault(name, {})
+            for sample, labels, value in rows:
+                series[sample, labels] = series.get((sample, labels), 0) + value
+    return {name: [(sample, labels, value) for (sample, labels), value in series.items()]
+            for name, series in merged.items()}
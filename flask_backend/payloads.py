@@ -0,0 +1,121 @@
+import hashlib
+import json
+import zlib
+
+# =========================
+# Payload encoding
+# =========================
+# Each distinct extraction result is stored once in ``payloads``, keyed by
+# the digest of its canonical JSON; queries rows point at it. The body is
+# the compact JSON, zlib-compressed when that makes it smaller.
+
+ENCODING_JSON = "json"
+ENCODING_JSON_ZLIB = "json+zlib"
+
+# Smaller bodies are never worth compressing
+COMPRESS_MIN_BYTES = 128
+COMPRESS_LEVEL = 6
+
+# Rows read per batch by copy_queries_to_payloads(), and payloads deleted
+# per transaction by delete_orphan_payloads()
+BATCH_SIZE = 500
+
+def canonical_json(result):
+    """The compact JSON text a result is stored and addressed by."""
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+
+def payload_digest(raw):
+    """Content address of a canonical_json() document's UTF-8 bytes."""
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+def encode_payload(raw, compress=True):
+    """(encoding, body) for a canonical_json() document's UTF-8 bytes."""
+    if compress and len(raw) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw, COMPRESS_LEVEL)
+        if len(packed) < len(raw):
+            return ENCODING_JSON_ZLIB, packed
+    return ENCODING_JSON, raw
+
+def payload_json(encoding, body):
+    """The JSON text of a stored payload."""
+    if encoding == ENCODING_JSON_ZLIB:
+        body = zlib.decompress(body)
+    elif encoding != ENCODING_JSON:
+        raise ValueError(f"unknown payload encoding: {encoding}")
+    return body.decode("utf-8")
+
+def decode_payload(encoding, body):
+    return json.loads(payload_json(encoding, body))
+
+# =========================
+# Storage
+# =========================
+def store_payloads(conn, documents, compress=True):
+    """Payload ids of canonical_json() ``documents``, inserting the ones not
+    stored yet. Runs inside the caller's transaction."""
+    ids, seen = [], {}
+    for document in documents:
+        raw = document.encode("utf-8")
+        digest = payload_digest(raw)
+        if digest not in seen:
+            row = conn.execute("SELECT id FROM payloads WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                # Only new payloads pay for compression
+                row = conn.execute(
+                    "INSERT INTO payloads (digest, encoding, body) VALUES (?, ?, ?) RETURNING id",
+                    (digest, *encode_payload(raw, compress)),
+                ).fetchone()
+            seen[digest] = row[0]
+        ids.append(seen[digest])
+    return ids
+
+def delete_orphan_payloads(conn, batch_size=BATCH_SIZE):
+    """Delete payloads no query points at any more, ``batch_size`` per
+    transaction; returns how many were deleted."""
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute('''
+                DELETE FROM payloads WHERE id IN (
+                    SELECT p.id FROM payloads AS p
+                    WHERE NOT EXISTS (SELECT 1 FROM queries AS q WHERE q.payload_id = p.id)
+                    LIMIT ?
+                )
+            ''', (batch_size,)).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+def database_bytes(conn):
+    """(file bytes, bytes in free pages) of the main database."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * page_size, free * page_size
+
+def copy_queries_to_payloads(conn, target, compress=True, batch_size=BATCH_SIZE):
+    """Copy every queries row into the ``target`` table, moving its inline
+    extracted_json into a shared payload (migration 6). Rows whose JSON
+    does not parse are copied inline. Runs inside the migration's
+    transaction."""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, raw_text, extracted_json, created_at FROM queries
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        inline, documents = [], []
+        for row in rows:
+            try:
+                documents.append((row, canonical_json(json.loads(row[2]))))
+            except (TypeError, ValueError):
+                inline.append(row)
+        payload_ids = store_payloads(conn, [document for _, document in documents], compress)
+        conn.executemany(
+            f"INSERT INTO {target} (id, raw_text, payload_id, created_at) VALUES (?, ?, ?, ?)",
+            [(row[0], row[1], payload_id, row[3]) for (row, _), payload_id in zip(documents, payload_ids)],
+        )
+        conn.executemany(f"INSERT INTO {target} (id, raw_text, extracted_json, created_at) VALUES (?, ?, ?, ?)", inline)
@@ -0,0 +1,222 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+
+_STOP = object()
+
+# =========================
+# Write-behind query logger
+# =========================
+class QueryLogWriter:
+    """Persists (raw_text, extracted_json) rows off the request path.
+
+    Requests enqueue rows on a bounded queue; a background thread drains
+    it and hands batches to ``write_batch`` (one transaction per batch)
+    once ``batch_size`` rows are pending or ``flush_interval`` seconds have
+    passed since the oldest pending row. When the queue is full the
+    overflow policy decides what happens to new rows:
+
+    - "block": wait for room (back-pressure on the request)
+    - "drop":  discard the row and count it
+    - "spill": append the row to ``spill_path`` as a JSON line; spilled
+      rows are replayed into the database the next time the writer starts
+    """
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=200,
+                 flush_interval=0.5, overflow="block", spill_path=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        if overflow == "spill" and not spill_path:
+            raise ValueError("overflow='spill' needs a spill_path")
+        self.write_batch = write_batch
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0, "written": 0, "dropped": 0, "spilled": 0,
+            "flushes": 0, "flush_errors": 0,
+            "flush_seconds_total": 0.0, "flush_seconds_max": 0.0,
+            "last_flush_seconds": 0.0, "last_flush_rows": 0,
+        }
+
+    def start(self):
+        """Start the writer thread (idempotent; restarts in a forked child)."""
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # Threads and queue locks do not survive fork()
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, raw_text, extracted_json):
+        """Queue one row; returns False if it was dropped."""
+        return self.submit_many([(raw_text, extracted_json)]) == 1
+
+    def submit_many(self, rows):
+        """Queue rows; returns how many were queued or spilled."""
+        self.start()
+        accepted = 0
+        for row in rows:
+            if self.overflow == "block":
+                self._queue.put(row)
+            else:
+                try:
+                    self._queue.put_nowait(row)
+                except queue.Full:
+                    if self.overflow == "drop":
+                        self._bump("dropped")
+                        continue
+                    self._spill([row])
+                    self._bump("spilled")
+            accepted += 1
+        self._bump("enqueued", accepted)
+        return accepted
+
+    def flush(self):
+        """Block until every row queued so far has been written."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self, timeout=10.0):
+        """Drain the queue and stop the writer thread."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def register_atexit(self):
+        """Drain outstanding rows when the interpreter exits."""
+        atexit.register(self.close)
+        return self
+
+    def stats(self):
+        """Counters plus the current queue depth."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self.max_queue
+        stats["flush_seconds_avg"] = (
+            stats["flush_seconds_total"] / stats["flushes"] if stats["flushes"] else 0.0
+        )
+        return stats
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _run(self):
+        try:
+            self._replay_spill()
+        except Exception:
+            # Never let the replay take the writer down: blocked submitters
+            # would wait forever
+            logger.exception("replaying the query log spill file failed")
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(pending)
+                self._queue.task_done()
+                return
+            if item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+
+            if len(pending) >= self.batch_size or (pending and time.monotonic() >= deadline):
+                self._flush(pending)
+                pending = []
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            self.write_batch(rows)
+        except Exception:
+            logger.exception("query log flush of %d rows failed", len(rows))
+            self._bump("flush_errors")
+            if self.spill_path:
+                self._spill(rows)
+                self._bump("spilled", len(rows))
+            else:
+                self._bump("dropped", len(rows))
+        else:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self._stats["written"] += len(rows)
+                self._stats["flushes"] += 1
+                self._stats["flush_seconds_total"] += elapsed
+                self._stats["flush_seconds_max"] = max(self._stats["flush_seconds_max"], elapsed)
+                self._stats["last_flush_seconds"] = elapsed
+                self._stats["last_flush_rows"] = len(rows)
+        finally:
+            for _ in rows:
+                self._queue.task_done()
+
+    def _spill(self, rows):
+        with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+            for raw_text, extracted_json in rows:
+                f.write(json.dumps({"raw_text": raw_text, "extracted_json": extracted_json}) + "\n")
+
+    def _replay_spill(self):
+        """Write rows spilled by an earlier run, then remove the spill file.
+
+        Lines that do not parse (a write cut short by a crash, say) are
+        moved to ``<spill_path>.bad`` and the rest are still replayed.
+        """
+        if not self.spill_path:
+            return
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        with self._spill_lock:
+            try:
+                os.replace(self.spill_path, replay_path)
+            except FileNotFoundError:
+                return
+        rows, bad = [], []
+        with open(replay_path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    r = json.loads(line)
+                    rows.append((r["raw_text"], r["extracted_json"]))
+                except (ValueError, KeyError, TypeError):
+                    bad.append(line if line.endswith("\n") else line + "\n")
+        if bad:
+            logger.warning("moved %d unreadable spilled query log lines to %s.bad", len(bad), self.spill_path)
+            with open(f"{self.spill_path}.bad", "a", encoding="utf-8") as out:
+                out.writelines(bad)
+        try:
+            self.write_batch(rows)
+        except Exception:
+            logger.exception("replaying %d spilled query log rows failed", len(rows))
+            self._spill(rows)
+        os.remove(replay_path)
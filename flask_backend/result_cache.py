@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+# =========================
+# Extraction result cache
+# =========================
+class _InFlight:
+    """A computation other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResultCache:
+    """Bounded LRU cache with a TTL and in-flight request coalescing.
+
+    ``get_or_compute`` returns a cached value when one is fresh. Otherwise
+    the first caller for a key computes it, and concurrent callers for the
+    same key wait for that result instead of repeating the work. Errors are
+    re-raised to every waiter and never cached. ``max_entries=0`` disables
+    caching (coalescing still applies).
+    """
+
+    def __init__(self, max_entries=4096, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._inflight = {}             # key -> _InFlight
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        """Return (True, value) for a fresh entry, else (False, None)."""
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._inflight[key] = _InFlight()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                self._store(key, flight.value)
+            return flight.value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def clear(self):
+        """Drop every entry (e.g. after the vocabularies change)."""
+        with self._lock:
+            self._stats["evictions"] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), max_entries=self.max_entries)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return True, value
+            del self._entries[key]
+            self._stats["expirations"] += 1
+        self._stats["misses"] += 1
+        return False, None
+
+    def _store(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
@@ -0,0 +1,256 @@
+"""Production entry point: a pre-forking WSGI server for app.py.
+
+    python serve.py [--host 0.0.0.0] [--port 5000] [--workers 4] [--max-requests 10000]
+
+The parent imports app (vocabulary, q-gram index, matchers and tokenizers
+are loaded from the artifact or compiled once), migrates the database,
+binds the listening socket and forks the workers, which share those
+structures copy-on-write; gc.freeze() keeps the collector from writing to
+(and so copying) them. Each worker serves one request at a time from the
+shared socket, so matching runs on as many cores as there are workers.
+Aim for one worker per core.
+
+A worker exits after --max-requests requests (plus up to
+--max-requests-jitter, so workers do not all restart together) and is
+replaced. SIGHUP replaces every worker; SIGTERM/SIGINT stop the server.
+Either way a worker finishes the request in hand, drains its query log
+and removes its decompressed archive copies before exiting.
+
+/metrics reports the sum over all workers, whichever one answers the
+scrape: each worker snapshots its metrics to a directory shared with the
+supervisor every metrics.SHARE_INTERVAL seconds, and the counters of
+exited workers are kept, so totals never go backwards across recycling.
+Other workers' values are up to that interval old.
+
+Measured throughput per worker (benchmark.py throughput --clients 4, the
+default corpus of 10-item lists with 10% typos, the shipped vocabulary,
+RESULT_CACHE_SIZE=0): 210-267 req/s, p50 13-16 ms, on a 1-vCPU 2.0 GHz
+Xeon VM where the clients share the core. The worker's own CPU time was
+3.1-3.9 ms per request, so one dedicated core serves about 250-320 req/s.
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import signal
+import shutil
+import socket
+import tempfile
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker waits on accept() before re-checking for shutdown
+WORKER_POLL_INTERVAL = 1.0
+
+# Seconds the supervisor sleeps between checks for exited workers
+SUPERVISOR_POLL_INTERVAL = 0.5
+
+class RequestHandler(WSGIRequestHandler):
+    # A client that stops sending must not hold a worker forever
+    timeout = 30
+
+def start_worker():
+    app.VOCABULARY.start()
+    app.METRICS.start_sharing()
+
+def close_worker():
+    """Clean-exit work for a worker: os._exit() skips atexit hooks."""
+    app.QUERY_LOG.close()
+    app.ARCHIVES.close()
+    app.METRICS.flush()
+
+# =========================
+# Pre-fork supervisor
+# =========================
+class PreforkServer:
+    """Forks ``workers`` processes that each serve ``wsgi_app`` from ``listener``.
+
+    ``after_fork`` runs in every new worker before it serves, and
+    ``before_exit`` in a worker that is about to exit cleanly.
+    ``on_worker_exit`` runs in the supervisor with the pid of every worker
+    it reaps, however the worker ended.
+    """
+
+    def __init__(self, wsgi_app, listener, workers, max_requests=0, max_requests_jitter=0,
+                 graceful_timeout=30.0, after_fork=None, before_exit=None, on_worker_exit=None):
+        self.wsgi_app = wsgi_app
+        self.listener = listener
+        self.worker_count = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.after_fork = after_fork
+        self.before_exit = before_exit
+        self.on_worker_exit = on_worker_exit
+        self.workers = set()
+        self._stopping = False
+        self._recycle = False
+
+    def run(self):
+        """Supervise workers until SIGTERM/SIGINT, then stop them gracefully."""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_recycle)
+        while not self._stopping:
+            if self._recycle:
+                self._recycle = False
+                logger.info("recycling %d workers", len(self.workers))
+                self._signal_workers(signal.SIGTERM)
+            self._reap()
+            while len(self.workers) < self.worker_count and not self._stopping:
+                self._spawn()
+            time.sleep(SUPERVISOR_POLL_INTERVAL)
+        self._shutdown()
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_recycle(self, signum, frame):
+        self._recycle = True
+
+    def _signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.workers.discard(pid)
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            self._exited(pid)
+            if os.waitstatus_to_exitcode(status) != 0:
+                logger.warning("worker %d exited with status %d", pid, os.waitstatus_to_exitcode(status))
+
+    def _exited(self, pid):
+        self.workers.discard(pid)
+        if self.on_worker_exit:
+            self.on_worker_exit(pid)
+
+    def _shutdown(self):
+        logger.info("stopping %d workers", len(self.workers))
+        self._signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        if self.workers:
+            logger.warning("killing %d workers after %.0fs", len(self.workers), self.graceful_timeout)
+            self._signal_workers(signal.SIGKILL)
+            while self.workers:
+                pid, _ = os.wait()
+                self._exited(pid)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            logger.info("started worker %d", pid)
+            return
+        status = 1
+        try:
+            self._serve()
+            status = 0
+        except BaseException:
+            logger.exception("worker %d failed", os.getpid())
+        finally:
+            # Never return into the supervisor loop or run its atexit hooks
+            os._exit(status)
+
+    def _serve(self):
+        """Worker loop: serve until told to stop or the request budget is used up."""
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C reaches the supervisor too
+
+        limit = 0
+        if self.max_requests:
+            limit = self.max_requests + random.Random().randint(0, self.max_requests_jitter)
+        served = 0
+
+        def counted_app(environ, start_response):
+            nonlocal served
+            served += 1
+            return self.wsgi_app(environ, start_response)
+
+        if self.after_fork:
+            self.after_fork()
+        host, port = self.listener.getsockname()[:2]
+        server = make_server(host, port, counted_app, request_handler=RequestHandler,
+                             fd=self.listener.fileno())
+        server.timeout = WORKER_POLL_INTERVAL
+        try:
+            while not stopping and not (limit and served >= limit):
+                server.handle_request()
+        finally:
+            server.server_close()
+            if self.before_exit:
+                self.before_exit()
+
+def listen(host, port, backlog=2048):
+    """The shared listening socket. It is non-blocking so that workers
+    woken for the same connection lose the accept() race instead of blocking."""
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.setblocking(False)
+    return sock
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the WhisperCart extraction backend with pre-forked workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+                        help="worker processes (default: WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--max-requests", type=int, default=10000,
+                        help="requests before a worker is replaced; 0 disables recycling (default: %(default)s)")
+    parser.add_argument("--max-requests-jitter", type=int, default=1000)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds workers get to finish on shutdown before SIGKILL")
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    app.init_database()
+    app.DB.close()
+    # Workers start their own watcher threads; none may be mid-reload at fork()
+    app.VOCABULARY.stop(timeout=app.VOCABULARY_POLL_INTERVAL)
+    listener = listen(args.host, args.port)
+    metrics_dir = tempfile.mkdtemp(prefix="whispercart-metrics-")
+    app.METRICS.share(metrics_dir)
+    gc.freeze()
+
+    logger.info("vocabulary %s (%s); %d workers on http://%s:%d",
+                app.VOCABULARY.current.version, app.VOCAB_SOURCE,
+                args.workers, args.host, args.port)
+    try:
+        PreforkServer(
+            app.app, listener, args.workers,
+            max_requests=args.max_requests,
+            max_requests_jitter=args.max_requests_jitter,
+            graceful_timeout=args.graceful_timeout,
+            after_fork=start_worker,
+            before_exit=close_worker,
+            on_worker_exit=app.METRICS.retire,
+        ).run()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
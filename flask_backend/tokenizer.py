@@ -0,0 +1,151 @@
+import re
+
+from nltk.tokenize import TreebankWordTokenizer
+from nltk.tokenize.util import align_tokens
+
+# =========================
+# Single-pass word tokenizer with character offsets
+# =========================
+# Produces exactly the tokens of PunktSentenceTokenizer (default
+# parameters) followed by TreebankWordTokenizer on every sentence, plus the
+# (start, end) character span of each token in the input.
+#
+# Punkt only considers a break at . ? ! followed by punctuation or by
+# whitespace and another token, so a text without such a candidate is one
+# sentence and Punkt is skipped. Each sentence is then tokenized by one
+# regex pass. Treebank's rules that depend on substitution order or on
+# the kind of whitespace (quotes, ellipses, double dashes, repeated , or :,
+# tabs/newlines, several apostrophes in one word) are not reproduced: a
+# sentence containing one goes through Treebank itself.
+
+_SENTENCE_END_CANDIDATE = re.compile(r"[.?!](?=[^\w\s]|\s+\S)")
+
+# Substrings that send a sentence to Treebank (as does any whitespace
+# other than a space, caught by str.isprintable())
+_TREEBANK_ONLY = ('"', "`", "''", "..", "--", ",,", ",:", ":,", "::")
+
+_PLAIN = r"[^\s;@#$%&?!\[\](){}<>,:.]"   # never split from its neighbours
+_JOIN = r"(?:[,:](?=\d)|\.(?![\])}>']*\ *$))"   # , : before a digit; non-final .
+
+_TOKEN = re.compile(rf"""
+    {_PLAIN}+ (?:{_JOIN} {_PLAIN}*)*    # a word
+  | [;@#$%&?!\[\](){{}}<>]              # always a token of its own
+  | [,:](?!\d)                          # , and : unless a digit follows
+  | \.(?=[\])}}>']*\ *$)                # the sentence-final period
+  | (?:{_JOIN} {_PLAIN}*)+              # a word starting with , : or .
+""", re.VERBOSE)
+
+# Clitics Treebank splits off the end of a word ("men's", "they'll"),
+# keyed by the text after the apostrophe
+_CLITICS = frozenset(["", "s", "S", "m", "M", "d", "D", "ll", "LL", "re", "RE", "ve", "VE"])
+
+# Words Treebank's CONTRACTIONS2/3 split ("gonna" -> "gon na")
+_CONTRACTION_WORDS = ("cannot", "d'ye", "gimme", "gonna", "gotta", "lemme", "more'n", "wanna", "'tis", "'twas")
+_CONTRACTIONS = TreebankWordTokenizer.CONTRACTIONS2 + TreebankWordTokenizer.CONTRACTIONS3
+
+# The only non-ASCII characters (?i) matches against ASCII letters
+_CASE_FOLD = str.maketrans("\u0130\u0131\u017f\u212a", "iisk")
+
+def _has_contraction(s):
+    lowered = s.lower() if s.isascii() else s.translate(_CASE_FOLD).lower()
+    return any(word in lowered for word in _CONTRACTION_WORDS)
+
+def _split_word(word, start, out):
+    """Append the Treebank tokens of one word (no spaces or split
+    punctuation inside) to ``out``; returns False if the word has more
+    than one apostrophe."""
+    apostrophes = word.count("'")
+    if apostrophes > 1:
+        return False
+    pieces = [word]
+    if apostrophes:
+        i = word.index("'")
+        head, tail = word[:i], word[i + 1:]
+        if head and tail in _CLITICS:
+            pieces = [head, word[i:]]
+        elif len(head) >= 2 and (tail, head[-1]) in (("t", "n"), ("T", "N")):
+            pieces = [head[:-1], word[i - 1:]]   # do|n't, CA|N'T
+
+    for piece in pieces:
+        if _has_contraction(piece):
+            padded = f" {piece} "
+            for regexp in _CONTRACTIONS:
+                padded = regexp.sub(r" \1 \2 ", padded)
+            parts = padded.split()
+        else:
+            parts = [piece]
+        for part in parts:
+            out.append((part, start, start + len(part)))
+            start += len(part)
+    return True
+
+class SpanTokenizer:
+    """my_word_tokenize() with character offsets.
+
+    ``span_tokenize(text)`` returns (token, start_char, end_char) triples;
+    ``tokenize(text)`` just the tokens. With ``fast=False`` every text goes
+    through the Punkt sentence splitter and the Treebank tokenizer, and
+    offsets are aligned afterwards.
+    """
+
+    def __init__(self, sentence_splitter, word_tokenizer, fast=True):
+        self.sentence_splitter = sentence_splitter
+        self.word_tokenizer = word_tokenizer
+        self.fast = fast
+
+    def tokenize(self, text):
+        return self._tokenize(text, False)
+
+    def span_tokenize(self, text):
+        return self._tokenize(text, True)
+
+    def _tokenize(self, text, with_spans):
+        out = []
+        if self.fast and not _SENTENCE_END_CANDIDATE.search(text):
+            end = len(text.rstrip())
+            sentences = [(0, end)] if end else []
+        else:
+            sentences = self.sentence_splitter.span_tokenize(text)
+        for start, end in sentences:
+            sentence = text[start:end]
+            if self.fast and self._fast_tokens(sentence, start, with_spans, out):
+                continue
+            if with_spans:
+                self._treebank_spans(sentence, start, out)
+            else:
+                out.extend(self.word_tokenizer.tokenize(sentence))
+        return out
+
+    def _fast_tokens(self, sentence, offset, with_spans, out):
+        if not sentence.isprintable() or any(s in sentence for s in _TREEBANK_ONLY):
+            return False
+        contractions = _has_contraction(sentence)
+        if "'" not in sentence and not contractions:
+            if with_spans:
+                out.extend((m.group(), offset + m.start(), offset + m.end())
+                           for m in _TOKEN.finditer(sentence))
+            else:
+                out.extend(_TOKEN.findall(sentence))
+            return True
+
+        spans = []
+        for m in _TOKEN.finditer(sentence):
+            word = m.group()
+            if "'" in word or (contractions and _has_contraction(word)):
+                if not _split_word(word, offset + m.start(), spans):
+                    return False
+            else:
+                spans.append((word, offset + m.start(), offset + m.end()))
+        out.extend(spans if with_spans else [tok for tok, _, _ in spans])
+        return True
+
+    def _treebank_spans(self, sentence, offset, out):
+        tokens = self.word_tokenizer.tokenize(sentence)
+        # Treebank rewrites " as `` or ''; align those against the source quotes
+        if '"' in sentence or "''" in sentence:
+            quotes = [m.group() for m in re.finditer(r"``|'{2}|\"", sentence)]
+            aligned = [quotes.pop(0) if tok in ('"', "``", "''") else tok for tok in tokens]
+        else:
+            aligned = tokens
+        for tok, (start, end) in zip(tokens, align_tokens(aligned, sentence)):
+            out.append((tok, offset + start, offset + end))
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+from matcher import QGRAM_SIZE, PhraseMatcher, QGramIndex
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pickled layout of CompiledVocabulary or the matcher
+# classes changes; older artifacts are then ignored and rebuilt.
+ARTIFACT_FORMAT = 3
+
+def vocabulary_fingerprint(*vocabularies):
+    """Short stable hash of the keyword lists; changes whenever any list does."""
+    payload = json.dumps(vocabularies, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+# =========================
+# Compiled vocabulary
+# =========================
+class CompiledVocabulary:
+    """The keyword lists plus everything precompiled from them: the shared
+    q-gram index, the three phrase matchers and the tokenizers.
+
+    Instances are never mutated after construction, so a request that
+    holds one sees a consistent snapshot even while a newer one is built.
+    """
+
+    def __init__(self, products, brands, colors, shade_to_root, threshold, tokenizers, previous=None):
+        self.products = list(products)
+        self.product_set = frozenset(self.products)
+        self.brands = list(brands)
+        self.colors = list(colors)
+        self.shade_to_root = dict(shade_to_root)
+        self.threshold = threshold
+        self.version = vocabulary_fingerprint(self.products, self.brands, self.colors, self.shade_to_root)
+
+        self.index = QGramIndex(
+            [self.products, self.brands, self.colors], threshold,
+            previous=previous.index if previous is not None else None,
+        )
+        self.product_matcher = PhraseMatcher(self.products, "product", threshold, self.index)
+        self.brand_matcher = PhraseMatcher(self.brands, "brand", threshold, self.index)
+        self.color_matcher = PhraseMatcher(self.colors, "color", threshold, self.index)
+        self.tokenizers = tokenizers
+
+    def header(self):
+        """What an artifact must match to be reused for this configuration."""
+        return {
+            "format": ARTIFACT_FORMAT,
+            "vocabulary_version": self.version,
+            "threshold": self.threshold,
+            "qgram_size": QGRAM_SIZE,
+        }
+
+# =========================
+# Artifact build / load
+# =========================
+def save_artifact(vocab, path):
+    """Serialize ``vocab`` to ``path`` atomically; returns the header."""
+    header = dict(vocab.header(), built_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".vocabulary-", suffix=".tmp")
+    try:
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(vocab, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return header
+
+def load_artifact(path, expected):
+    """Return the CompiledVocabulary in ``path`` if its header matches
+    ``expected`` (format, vocabulary version, threshold, q), else None."""
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            mismatched = {k: (header.get(k), v) for k, v in expected.items() if header.get(k) != v}
+            if mismatched:
+                logger.warning("ignoring stale vocabulary artifact %s: %s", path, mismatched)
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("failed to load vocabulary artifact %s", path)
+        return None
+
+def load_or_compile(path, products, brands, colors, shade_to_root, threshold, make_tokenizers):
+    """Load the compiled vocabulary from ``path`` when it is current,
+    otherwise compile it in-process. Returns (vocab, source)."""
+    expected = {
+        "format": ARTIFACT_FORMAT,
+        "vocabulary_version": vocabulary_fingerprint(list(products), list(brands), list(colors), dict(shade_to_root)),
+        "threshold": threshold,
+        "qgram_size": QGRAM_SIZE,
+    }
+    if path:
+        vocab = load_artifact(path, expected)
+        if vocab is not None:
+            return vocab, "artifact"
+    return CompiledVocabulary(products, brands, colors, shade_to_root, threshold, make_tokenizers()), "compiled"
+
+# =========================
+# Vocabulary sources
+# =========================
+# A source is "file:<path>" (JSON) or "sqlite:<path>" (the ``vocabulary``
+# table). The JSON file looks like:
+#
+#   {"products": [...], "brands": [...], "root_colors": [...],
+#    "shade_to_root": {"navy blue": "blue", ...}}
+#
+# and the table holds one row per phrase, read in rowid order:
+#
+#   kind    'product' | 'brand' | 'color' | 'shade'
+#   phrase  the keyword
+#   root    root color, for kind = 'shade'
+def derive_colors(root_colors, shade_to_root):
+    """COLOR_KEYWORDS: roots plus every shade."""
+    return sorted(set(list(root_colors) + list(shade_to_root.keys())))
+
+def read_vocabulary_source(source):
+    """Return (products, brands, colors, shade_to_root) from ``source``."""
+    kind, _, path = source.partition(":")
+    if kind == "file":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        products, brands = data["products"], data["brands"]
+        roots, shade_to_root = data.get("root_colors", []), data.get("shade_to_root", {})
+    elif kind == "sqlite":
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT kind, phrase, root FROM vocabulary ORDER BY rowid").fetchall()
+        finally:
+            conn.close()
+        products = [p for k, p, _ in rows if k == "product"]
+        brands = [p for k, p, _ in rows if k == "brand"]
+        roots = [p for k, p, _ in rows if k == "color"]
+        shade_to_root = {p: r for k, p, r in rows if k == "shade"}
+    else:
+        raise ValueError(f"unknown vocabulary source {source!r}; use file:<path> or sqlite:<path>")
+    if not products:
+        raise ValueError(f"vocabulary source {source!r} has no products")
+    return products, brands, derive_colors(roots, shade_to_root), shade_to_root
+
+def source_stamp(source, conn=None):
+    """Cheap change detector for a source: file stat, or SQLite's
+    data_version on a long-lived connection (bumps on other writers' commits)."""
+    kind, _, path = source.partition(":")
+    if kind == "file":
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+# =========================
+# Hot-reloading store
+# =========================
+class VocabularyStore:
+    """Holds the active CompiledVocabulary and swaps in new ones.
+
+    ``current`` is replaced with a single attribute assignment once a new
+    vocabulary is fully built, so readers either get the old snapshot or
+    the new one, never a half-built index. With a ``source`` configured, a
+    watcher thread polls it every ``poll_interval`` seconds and rebuilds in
+    the background (reusing unchanged index buckets) when it changes;
+    ``on_swap`` runs after every swap, e.g. to clear result caches.
+    """
+
+    def __init__(self, vocab, threshold, source=None, poll_interval=5.0, on_swap=None, loaded_from="builtin"):
+        self.current = vocab
+        self.threshold = threshold
+        self.source = source
+        self.poll_interval = poll_interval
+        self.on_swap = on_swap
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stamp = None
+        self._conn = None
+        self._status = {
+            "loaded_from": loaded_from,
+            "loaded_at": time.time(),
+            "rebuilds": 0,
+            "last_rebuild_seconds": None,
+            "last_rebuild_reused_buckets": None,
+            "last_check_at": None,
+            "last_error": None,
+        }
+
+    def status(self):
+        vocab = self.current
+        return dict(
+            self._status,
+            version=vocab.version,
+            source=self.source or "builtin",
+            products=len(vocab.products),
+            brands=len(vocab.brands),
+            colors=len(vocab.colors),
+            indexed_phrases=len(vocab.index.phrases),
+        )
+
+    def reload(self, force=False):
+        """Re-read the source and swap in a rebuilt vocabulary if it changed.
+
+        Returns True when a new vocabulary was swapped in.
+        """
+        if not self.source:
+            return False
+        with self._reload_lock:
+            self._status["last_check_at"] = time.time()
+            try:
+                if self.source.startswith("sqlite:") and self._conn is None:
+                    self._conn = sqlite3.connect(self.source.partition(":")[2], check_same_thread=False)
+                stamp = source_stamp(self.source, self._conn)
+                if not force and stamp == self._stamp:
+                    return False
+                products, brands, colors, shade_to_root = read_vocabulary_source(self.source)
+                self._stamp = stamp
+                if vocabulary_fingerprint(products, brands, colors, shade_to_root) == self.current.version:
+                    return False
+
+                started = time.perf_counter()
+                old = self.current
+                new = CompiledVocabulary(products, brands, colors, shade_to_root,
+                                         self.threshold, old.tokenizers, previous=old)
+                elapsed = time.perf_counter() - started
+            except Exception as e:
+                logger.exception("vocabulary reload from %s failed", self.source)
+                self._status["last_error"] = str(e)
+                return False
+
+            self.current = new
+            self._status.update(
+                loaded_from=self.source,
+                loaded_at=time.time(),
+                rebuilds=self._status["rebuilds"] + 1,
+                last_rebuild_seconds=elapsed,
+                last_rebuild_reused_buckets=new.index.reused_buckets,
+                last_error=None,
+            )
+        logger.info("vocabulary %s -> %s rebuilt in %.3fs", old.version, new.version, elapsed)
+        if self.on_swap is not None:
+            self.on_swap()
+        return True
+
+    def start(self):
+        """Start the watcher thread (idempotent; restarts in a forked child)."""
+        if not self.source or (self._thread is not None and self._pid == os.getpid()):
+            return
+        if self._pid is not None and self._pid != os.getpid():
+            # Locks and connections inherited across fork() are not reused
+            self._reload_lock = threading.Lock()
+            self._conn = None
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="vocabulary-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the watcher thread; with ``timeout``, wait up to that long for it to exit."""
+        self._stop.set()
+        if timeout is not None and self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+WhisperCart intent engine - category, budget and features in one pass
+
+Every category keyword, feature keyword and budget pattern is compiled
+into a single regex at import (the keywords as one character trie);
+analyze_intent() runs it once over the lowercased text. Used by whispercart_ai, whispercart_real_api and
+WHISPERCART_DEMO so they all understand a request the same way.
+
+    python intent_engine.py [--corpus intent_corpus.jsonl] [--runs N]
+
+checks the consistency corpus (against the engine and every entry point
+whose dependencies are installed) and prints a microbenchmark.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
+Intent = namedtuple('Intent', 'category budget features')
+
+DEFAULT_CATEGORY = 'running shoes'
+DEFAULT_BUDGET = 3000
+
+# When several categories are mentioned, the first one listed here wins
+CATEGORY_KEYWORDS = {
+    'headphones': ['headphone', 'earphone', 'earbud', 'audio'],
+    'smartphones': ['smartphone', 'phone', 'mobile', 'android', 'iphone'],
+    'laptops': ['laptop', 'gaming laptop', 'computer', 'notebook'],
+    'watches': ['watch', 'watches', 'smartwatch', 'smart watch'],
+    'running shoes': ['running shoes', 'shoe', 'sneaker', 'running'],
+}
+
+# Features are reported in this order
+FEATURE_KEYWORDS = {
+    'comfortable': ['comfortable', 'comfort'],
+    'premium': ['premium', 'best', 'high-end', 'flagship', 'top'],
+    'budget-friendly': ['budget', 'cheap', 'affordable', 'inexpensive', 'low-cost'],
+    'lightweight': ['lightweight', 'light', 'portable'],
+    'noise cancelling': [
+        'noise cancelling', 'noise canceling', 'noise cancellation', 'noise cancel',
+        'noise-cancelling', 'noise-canceling', 'noise-cancellation', 'anc', 'quiet',
+    ],
+}
+
+# An amount: "5000", "20,000" or "1,00,000"
+AMOUNT = r'(?:\d{1,3}(?:,\d{2,3})+(?!\d)|\d+)'
+
+# Highest priority first: the first match of the best pattern present is
+# the budget, wherever it is in the text
+BUDGET_PATTERNS = [
+    r'\bunder\s+₹?\s*({})',
+    r'\bwithin\s+₹?\s*({})',
+    r'\bbelow\s+₹?\s*({})',
+    r'\bup\s+to\s+₹?\s*({})',
+    r'({})\s*rupees?\b',
+    r'₹\s*({})',
+    r'({})',
+]
+# The last two are one rule: any amount, ₹-prefixed or not
+BUDGET_PRIORITY = [0, 1, 2, 3, 4, 5, 5]
+
+# keyword -> ('category' | 'feature', name)
+INTENT_KEYWORDS = {
+    keyword: (kind, value)
+    for kind, table in (('category', CATEGORY_KEYWORDS), ('feature', FEATURE_KEYWORDS))
+    for value, keywords in table.items()
+    for keyword in keywords
+}
+
+def _trie_pattern(words):
+    """Regex matching any of ``words``, as a character trie: each prefix is
+    tried once, and the longest word wins."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}  # a word ends here
+
+    def pattern(node):
+        branches = [
+            (r'\s+' if ch == ' ' else re.escape(ch)) + pattern(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return f'(?:{body})?'
+        return body
+    return pattern(trie)
+
+def _compile():
+    """One regex for every budget pattern (groups b0, b1, ...) and keyword
+    (group ``keyword``). Matches only start at a word or a ₹ sign."""
+    budgets = [pattern.format(f'?P<b{i}>{AMOUNT}') for i, pattern in enumerate(BUDGET_PATTERNS)]
+    keywords = r'\b(?P<keyword>{})s?\b'.format(_trie_pattern(INTENT_KEYWORDS))
+    return re.compile(r'(?=[\w₹])(?:\b|(?=₹))(?:{})'.format('|'.join(budgets + [keywords])))
+
+INTENT_PATTERN = _compile()
+CATEGORY_RANK = {category: rank for rank, category in enumerate(CATEGORY_KEYWORDS)}
+FEATURE_RANK = {feature: rank for rank, feature in enumerate(FEATURE_KEYWORDS)}
+
+def analyze_intent(text, default_category=DEFAULT_CATEGORY, default_budget=DEFAULT_BUDGET):
+    """Intent(category, budget, features) of a shopping request."""
+    category = budget = None
+    budget_priority = len(BUDGET_PATTERNS)
+    features = set()
+    for m in INTENT_PATTERN.finditer(text.lower()):
+        group = m.lastgroup
+        if group == 'keyword':
+            kind, value = INTENT_KEYWORDS[' '.join(m.group(group).split())]
+            if kind == 'feature':
+                features.add(value)
+            elif category is None or CATEGORY_RANK[value] < CATEGORY_RANK[category]:
+                category = value
+        elif BUDGET_PRIORITY[int(group[1:])] < budget_priority:
+            budget_priority = BUDGET_PRIORITY[int(group[1:])]
+            budget = int(m.group(group).replace(',', ''))
+    return Intent(
+        category or default_category,
+        default_budget if budget is None else budget,
+        sorted(features, key=FEATURE_RANK.get),
+    )
+
+# =========================
+# Consistency corpus and benchmark
+# =========================
+def entry_points():
+    """(name, text -> intent tuple) for every entry point that imports here."""
+    found = []
+    try:
+        from whispercart_ai import WhisperCartAI
+    except ImportError as e:
+        print(f"⚠️ whispercart_ai skipped: {e}")
+    else:
+        assistant = object.__new__(WhisperCartAI)  # no TTS engine needed
+
+        def analyze(text):
+            intent = assistant.analyze_intent(text)
+            return intent['product'], intent['budget'], intent['features']
+        found.append(('whispercart_ai', analyze))
+    try:
+        from whispercart_real_api import WhisperCartRealAPI
+    except ImportError as e:
+        print(f"⚠️ whispercart_real_api skipped: {e}")
+    else:
+        found.append(('whispercart_real_api', object.__new__(WhisperCartRealAPI).ai_analyze_request))
+    with contextlib.redirect_stdout(io.StringIO()):  # the demo prints its banner on import
+        import WHISPERCART_DEMO
+    found.append(('WHISPERCART_DEMO', WHISPERCART_DEMO.ai_analyze_request))
+    return found
+
+def check_corpus(path):
+    """Compare the engine and every entry point with the corpus; returns
+    (failure count, corpus texts)."""
+    with open(path, encoding='utf-8') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    failures = 0
+    for case in cases:
+        expected = Intent(case['category'], case['budget'], case['features'])
+        if analyze_intent(case['text']) != expected:
+            failures += 1
+            print(f"❌ engine: {case['text']!r} -> {analyze_intent(case['text'])}, expected {expected}")
+    for name, analyze in entry_points():
+        for case in cases:
+            with contextlib.redirect_stdout(io.StringIO()):
+                got = analyze(case['text'])
+            if tuple(got) != tuple(analyze_intent(case['text']))[:len(got)]:
+                failures += 1
+                print(f"❌ {name}: {case['text']!r} -> {got}")
+    print(f"{'✅' if not failures else '❌'} {len(cases)} corpus cases, {failures} failures")
+    return failures, [case['text'] for case in cases]
+
+def benchmark(texts, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        for text in texts:
+            analyze_intent(text)
+    per_call = (time.perf_counter() - started) / (runs * len(texts))
+    print(f"⚡ analyze_intent: {per_call * 1e6:.1f} µs per request ({runs * len(texts):,} calls)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the intent corpus and benchmark analyze_intent().")
+    parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.jsonl'))
+    parser.add_argument('--runs', type=int, default=2000)
+    args = parser.parse_args()
+    failures, texts = check_corpus(args.corpus)
+    benchmark(texts, args.runs)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+WhisperCart product catalog - columnar, price-sorted product data
+
+Each category is held as parallel columns sorted by price, so a budget
+query is a bisect and the cheapest deals are a prefix of the columns.
+Deal dicts are only built for the rows that are actually read.
+
+    python product_catalog.py [ROWS]    # query benchmark on a synthetic catalog
+"""
+
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+
+try:
+    import numpy as np
+except ImportError:  # array-backed columns, scalar deal math
+    np = None
+
+# AI-negotiated deal: the same discount on every product
+DISCOUNT_PERCENT = 15
+PRICE_FACTOR = 0.85
+
+# Shorter slices (a top-3 display) are cheaper with scalar math than numpy
+VECTORIZE_MIN_ROWS = 64
+
+class CategoryColumns:
+    """One category's products as parallel columns, cheapest first.
+
+    Ties on price keep the catalog's order. Stores are interned: each row
+    holds an index into ``stores``.
+    """
+
+    def __init__(self, products):
+        rows = sorted(products, key=lambda p: p['price'])
+        self.names = [p['name'] for p in rows]
+        store_codes = {}
+        self.store_codes = array('I', (store_codes.setdefault(p['store'], len(store_codes)) for p in rows))
+        self.stores = list(store_codes)
+        self.ratings = array('d', (p['rating'] for p in rows))
+        prices = array('q', (p['price'] for p in rows))
+        self.prices = np.frombuffer(prices, dtype=np.int64) if np is not None else prices
+
+    def __len__(self):
+        return len(self.names)
+
+    def count_within(self, budget):
+        """Number of products priced at or under ``budget``."""
+        if np is not None:
+            return int(np.searchsorted(self.prices, budget, side='right'))
+        return bisect_right(self.prices, budget)
+
+    def deals(self, start, stop):
+        """find_products() dicts for rows [start, stop)."""
+        if np is not None and stop - start >= VECTORIZE_MIN_ROWS:
+            prices = self.prices[start:stop]
+            negotiated = (prices * PRICE_FACTOR).astype(np.int64)
+            prices, negotiated, savings = prices.tolist(), negotiated.tolist(), (prices - negotiated).tolist()
+        else:
+            prices = self.prices[start:stop].tolist()
+            negotiated = [int(price * PRICE_FACTOR) for price in prices]
+            savings = [price - deal for price, deal in zip(prices, negotiated)]
+        return [
+            {
+                'name': self.names[row],
+                'price': price,
+                'store': self.stores[self.store_codes[row]],
+                'rating': self.ratings[row],
+                'original_price': price,
+                'negotiated_price': deal,
+                'savings': saved,
+                'discount_percent': DISCOUNT_PERCENT,
+            }
+            for row, price, deal, saved in zip(range(start, stop), prices, negotiated, savings)
+        ]
+
+class Deals(Sequence):
+    """The affordable products of a category, best deal (cheapest) first.
+
+    Behaves like the list find_products() used to return, but only the
+    dicts that are indexed or sliced are built.
+    """
+
+    def __init__(self, columns, count):
+        self.columns = columns
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            if step == 1:
+                return self.columns.deals(start, max(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("deal index out of range")
+        return self.columns.deals(index, index + 1)[0]
+
+    def __repr__(self):
+        return f"Deals({self.count} products)"
+
+class ProductCatalog:
+    """Price-sorted columns for every category of a {category: [product, ...]} dict."""
+
+    def __init__(self, products):
+        self.categories = {category: CategoryColumns(items) for category, items in products.items()}
+
+    def find(self, category, budget):
+        """Deals for ``category`` priced at or under ``budget``, cheapest first."""
+        columns = self.categories.get(category)
+        if columns is None:
+            return []
+        return Deals(columns, columns.count_within(budget))
+
+def benchmark(rows=1_000_000, queries=2000, top=3):
+    """Build a synthetic one-category catalog and time find() + top-k reads."""
+    import random
+    rnd = random.Random(42)
+    stores = ['Nike', 'Adidas', 'Puma', 'Reebok', 'Samsung', 'Apple', 'Sony', 'boAt']
+    products = [
+        {'name': f'Product {i}', 'price': rnd.randint(500, 200000),
+         'store': rnd.choice(stores), 'rating': round(rnd.uniform(3, 5), 1)}
+        for i in range(rows)
+    ]
+    started = time.perf_counter()
+    catalog = ProductCatalog({'bench': products})
+    built = time.perf_counter() - started
+
+    budgets = [rnd.randint(0, 210000) for _ in range(queries)]
+    started = time.perf_counter()
+    for budget in budgets:
+        deals = catalog.find('bench', budget)
+        len(deals), deals[:top]
+    per_query = (time.perf_counter() - started) / queries
+    print(f"📦 {rows:,} rows, built in {built:.2f}s ({'numpy' if np is not None else 'array'} columns)")
+    print(f"⚡ find + top {top}: {per_query * 1e6:.1f} µs per query")
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+WhisperCart speech queue - text-to-speech off the caller's thread
+
+A single worker thread owns the TTS engine and speaks queued utterances
+in priority order, so searching and printing carry on while it talks.
+say() returns at once; interrupt=True drops everything still queued and
+cuts off the utterance being spoken (a new result makes older
+announcements stale). The worker records how long it spoke, so stats()
+can show how much speaking time no longer blocks each interaction.
+
+On macOS pyttsx3 has to run on the main thread, so there say() speaks
+before returning, as the blocking speak() did.
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+
+# Lower is spoken first; equal priorities keep submission order
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+class NullBackend:
+    """Speaks nothing, for headless runs. With ``words_per_minute`` it takes
+    as long as real speech would, which lets the timing stats be tried out."""
+
+    threaded = True
+
+    def __init__(self, words_per_minute=None):
+        self.words_per_minute = words_per_minute
+
+    def open(self):
+        pass
+
+    def speak(self, text, cancelled):
+        if self.words_per_minute:
+            cancelled.wait(len(text.split()) * 60.0 / self.words_per_minute)
+
+    def close(self):
+        pass
+
+class Pyttsx3Backend:
+    """pyttsx3, created on (and only used from) the thread that speaks.
+
+    On Windows the SAPI5 driver is a COM object, so open() initialises COM
+    on that thread and close() releases it. On macOS the NSSpeechSynthesizer
+    driver needs the main thread's run loop, so ``threaded`` is False there
+    and SpeechQueue speaks on the caller's thread: say() returns only once
+    the text has been spoken, and no speaking time is hidden.
+    """
+
+    threaded = sys.platform != 'darwin'
+
+    def __init__(self, rate=180, volume=0.9):
+        self.rate = rate
+        self.volume = volume
+        self.engine = None
+        self._cancelled = None
+        self._com = False
+
+    def open(self):
+        if sys.platform == 'win32':
+            import pythoncom
+            pythoncom.CoInitialize()
+            self._com = True
+        try:
+            import pyttsx3
+            self.engine = pyttsx3.init()
+            self.engine.setProperty('rate', self.rate)
+            self.engine.setProperty('volume', self.volume)
+            self.engine.connect('started-word', self._on_word)
+        except Exception:
+            self.close()   # the queue falls back to a NullBackend, which never closes this one
+            raise
+
+    def _on_word(self, name, location, length):
+        # Runs inside runAndWait() on the worker thread, where stop() is safe
+        if self._cancelled is not None and self._cancelled.is_set():
+            self.engine.stop()
+
+    def speak(self, text, cancelled):
+        self._cancelled = cancelled
+        self.engine.say(text)
+        self.engine.runAndWait()
+
+    def close(self):
+        self.engine = None
+        if self._com:
+            import pythoncom
+            pythoncom.CoUninitialize()
+            self._com = False
+
+class Utterance:
+    def __init__(self, text, priority, interaction):
+        self.text = text
+        self.priority = priority
+        self.interaction = interaction
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until it has been spoken or dropped."""
+        return self.done.wait(timeout)
+
+class SpeechQueue:
+    """Priority queue of utterances spoken by one worker thread.
+
+    ``backend`` is a backend instance (see NullBackend and Pyttsx3Backend),
+    opened on the worker. If opening it fails the queue falls back to a
+    NullBackend; ``available`` says whether real speech is on. A backend
+    whose ``threaded`` is False is opened and spoken on the caller's thread
+    instead, one utterance per say(), with no worker.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or NullBackend()
+        self.available = True
+        self.error = None
+        self._cond = threading.Condition()
+        self._pending = []             # heap of (priority, seq, Utterance)
+        self._seq = itertools.count()
+        self._current = None
+        self._closing = False
+        self._interaction = 0
+        self._stats = {'spoken': 0, 'cancelled': 0, 'dropped': 0}
+        self._timings = {}             # interaction -> [speech seconds, waited seconds]
+
+        if getattr(self.backend, 'threaded', True):
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name='speech', daemon=True)
+            self._thread.start()
+            ready.wait()
+        else:
+            self._thread = None
+            self._open_backend()
+
+    # -------------------------
+    # Caller side
+    # -------------------------
+    def say(self, text, priority=NORMAL, interrupt=False):
+        """Queue ``text``; with ``interrupt`` everything queued or being
+        spoken before it is dropped first. Returns the Utterance."""
+        with self._cond:
+            if interrupt:
+                self._cancel_locked()
+            utterance = Utterance(text, priority, self._interaction)
+            if self._thread is not None:
+                heapq.heappush(self._pending, (priority, next(self._seq), utterance))
+                self._cond.notify_all()
+                return utterance
+            self._current = utterance
+
+        # No worker: the caller waits for the whole utterance
+        started = time.perf_counter()
+        self._speak(utterance)
+        with self._cond:
+            self._timing(utterance.interaction)[1] += time.perf_counter() - started
+        return utterance
+
+    def cancel(self):
+        """Drop every queued utterance and cut off the one being spoken."""
+        with self._cond:
+            self._cancel_locked()
+
+    def _cancel_locked(self):
+        for _, _, utterance in self._pending:
+            utterance.cancelled.set()
+            utterance.done.set()
+        self._stats['dropped'] += len(self._pending)
+        self._pending.clear()
+        if self._current is not None:
+            self._current.cancelled.set()
+        self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until everything queued has been spoken; the time spent here
+        counts as not hidden. Returns False on timeout."""
+        started = time.perf_counter()
+        with self._cond:
+            idle = self._cond.wait_for(lambda: not self._pending and self._current is None, timeout)
+            self._timing(self._interaction)[1] += time.perf_counter() - started
+        return idle
+
+    def begin_interaction(self):
+        """Start attributing speech to the next interaction (one request/answer)."""
+        with self._cond:
+            self._interaction += 1
+
+    def close(self, drain=True):
+        """Stop the worker, after speaking what is queued unless ``drain`` is False."""
+        if drain:
+            self.wait()
+        else:
+            self.cancel()
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is None:
+            self.backend.close()
+        else:
+            self._thread.join()
+
+    def stats(self):
+        """Utterance counts, and seconds of speech vs seconds the caller waited
+        for it: the difference is time a blocking speak() would have cost."""
+        with self._cond:
+            per_interaction = [
+                {'interaction': i, 'speech_seconds': spoken, 'waited_seconds': waited,
+                 'hidden_seconds': max(0.0, spoken - waited)}
+                for i, (spoken, waited) in sorted(self._timings.items())
+            ]
+            stats = dict(self._stats)
+        speech = sum(t['speech_seconds'] for t in per_interaction)
+        hidden = sum(t['hidden_seconds'] for t in per_interaction)
+        return dict(
+            stats,
+            speech_seconds=speech,
+            waited_seconds=sum(t['waited_seconds'] for t in per_interaction),
+            hidden_seconds=hidden,
+            hidden_seconds_per_interaction=hidden / len(per_interaction) if per_interaction else 0.0,
+            interactions=per_interaction,
+        )
+
+    def _timing(self, interaction):
+        return self._timings.setdefault(interaction, [0.0, 0.0])
+
+    # -------------------------
+    # Worker
+    # -------------------------
+    def _open_backend(self):
+        try:
+            self.backend.open()
+        except Exception as e:
+            self.available, self.error = False, e
+            self.backend = NullBackend()
+
+    def _run(self, ready):
+        self._open_backend()
+        ready.set()
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    break
+                _, _, utterance = heapq.heappop(self._pending)
+                self._current = utterance
+            self._speak(utterance)
+        self.backend.close()
+
+    def _speak(self, utterance):
+        started = time.perf_counter()
+        try:
+            self.backend.speak(utterance.text, utterance.cancelled)
+        except Exception as e:
+            self.error = e
+        spoken = time.perf_counter() - started
+
+        with self._cond:
+            self._current = None
+            self._stats['cancelled' if utterance.cancelled.is_set() else 'spoken'] += 1
+            self._timing(utterance.interaction)[0] += spoken
+            utterance.done.set()
+            self._cond.notify_all()
@@ -4,23 +4,23 @@ WhisperCart AI - Voice-Powered Shopping Assistant
 A complete AI shopping assistant that actually works!
 """
 
-import pyttsx3
 import json
 import time
 import sys
 import os
 from datetime import datetime
 
+from intent_engine import analyze_intent
+from product_catalog import DISCOUNT_PERCENT, ProductCatalog
+from speech_queue import HIGH, NORMAL, NullBackend, Pyttsx3Backend, SpeechQueue
+
 class WhisperCartAI:
-    def __init__(self):
-        # Initialize text-to-speech only (no microphone needed)
-        try:
-            self.engine = pyttsx3.init()
-            self.engine.setProperty('rate', 180)
-            self.engine.setProperty('volume', 0.9)
-            self.tts_available = True
-        except:
-            self.tts_available = False
+    def __init__(self, tts=True):
+        # Initialize text-to-speech only (no microphone needed). Speech runs on
+        # its own thread, so searching never waits for it.
+        self.speech = SpeechQueue(Pyttsx3Backend(rate=180, volume=0.9) if tts else NullBackend())
+        self.tts_available = tts and self.speech.available
+        if tts and not self.tts_available:
             print("⚠️ Text-to-speech not available, will use text only")
 
         # Voice simulation mode (works without microphone)
@@ -70,6 +70,8 @@ class WhisperCartAI:
                 {'name': 'Fire-Boltt Ninja Call Pro Plus', 'price': 1799, 'store': 'Fire-Boltt', 'rating': 3.9}
             ]
         }
+        # Price-sorted columns of the same products, for find_products()
+        self.catalog = ProductCatalog(self.products)
 
         # Statistics
         self.stats = {
@@ -82,11 +84,21 @@ class WhisperCartAI:
         print("🤖 Your AI Shopping Assistant is ready!")
         print("=" * 50)
 
-    def speak(self, text):
-        """Convert text to speech"""
+    def speak(self, text, priority=NORMAL, interrupt=False):
+        """Queue text for speech and return at once; ``interrupt`` drops the
+        announcements still queued or playing"""
         print(f"🎤 WhisperCart: {text}")
-        self.engine.say(text)
-        self.engine.runAndWait()
+        self.speech.say(text, priority, interrupt)
+
+    def shutdown(self):
+        """Finish speaking, then report how much speech ran alongside the searches"""
+        self.speech.close()
+        speech = self.speech.stats()
+        if self.tts_available and speech['interactions']:
+            print(f"🔊 Speech: {speech['speech_seconds']:.1f}s spoken, "
+                  f"{speech['hidden_seconds']:.1f}s of it without blocking "
+                  f"({speech['hidden_seconds_per_interaction']:.1f}s per interaction), "
+                  f"{speech['cancelled'] + speech['dropped']} stale announcements skipped")
 
     def listen(self):
         """Simulated voice input - type what you want to say"""
@@ -137,64 +149,14 @@ class WhisperCartAI:
         """AI analysis of user intent"""
         print("🤖 AI analyzing your request...")
 
+        category, budget, features = analyze_intent(text)
         intent = {
             'action': 'search',
-            'product': 'running shoes',  # default
-            'budget': 3000,  # default
-            'features': []
+            'product': category,
+            'budget': budget,
+            'features': features
         }
 
-        # Extract product type - more flexible matching
-        text_lower = text.lower()
-
-        # Shoes
-        if any(word in text_lower for word in ['running shoes', 'sneakers', 'shoes', 'shoe']):
-            intent['product'] = 'running shoes'
-        # Phones
-        elif any(word in text_lower for word in ['smartphone', 'phone', 'mobile', 'android', 'iphone']):
-            intent['product'] = 'smartphones'
-        # Laptops
-        elif any(word in text_lower for word in ['laptop', 'computer', 'notebook', 'gaming laptop']):
-            intent['product'] = 'laptops'
-        # Headphones
-        elif any(word in text_lower for word in ['headphones', 'earphones', 'headphone', 'earphone', 'earbuds']):
-            intent['product'] = 'headphones'
-        # Watches
-        elif any(word in text_lower for word in ['watch', 'smartwatch', 'watches', 'smart watch']):
-            intent['product'] = 'watches'
-
-        # Extract budget - improved regex
-        import re
-        # Look for patterns like "under 5000", "within 20000", "below 3000", "up to 10000"
-        budget_patterns = [
-            r'under\s+(\d+)',
-            r'within\s+(\d+)',
-            r'below\s+(\d+)',
-            r'up\s+to\s+(\d+)',
-            r'(\d+)\s+rupees?',
-            r'₹?\s*(\d+)'
-        ]
-
-        for pattern in budget_patterns:
-            budget_match = re.search(pattern, text_lower)
-            if budget_match:
-                intent['budget'] = int(budget_match.group(1))
-                break
-
-        # Extract features - expanded list
-        features_map = {
-            'comfortable': ['comfortable', 'comfort'],
-            'premium': ['premium', 'best', 'high-end', 'flagship', 'top'],
-            'budget-friendly': ['budget', 'cheap', 'affordable', 'inexpensive', 'low-cost'],
-            'lightweight': ['lightweight', 'light', 'portable'],
-            'noise cancelling': ['noise cancelling', 'anc', 'noise cancel', 'quiet']
-        }
-
-        for feature, keywords in features_map.items():
-            if any(keyword in text_lower for keyword in keywords):
-                if feature not in intent['features']:
-                    intent['features'].append(feature)
-
         print(f"🔍 Extracted - Product: {intent['product']}, Budget: ₹{intent['budget']}, Features: {intent['features']}")
 
         return intent
@@ -203,42 +165,25 @@ class WhisperCartAI:
         """Find products matching user intent"""
         print(f"🛒 Searching for {intent['product']} under ₹{intent['budget']}...")
 
-        category_products = self.products.get(intent['product'], [])
-        matching_products = []
-
-        for product in category_products:
-            if product['price'] <= intent['budget']:
-                # Calculate AI-negotiated price (15% discount)
-                negotiated_price = int(product['price'] * 0.85)
-                savings = product['price'] - negotiated_price
-
-                product_with_deal = product.copy()
-                product_with_deal['original_price'] = product['price']
-                product_with_deal['negotiated_price'] = negotiated_price
-                product_with_deal['savings'] = savings
-                product_with_deal['discount_percent'] = 15
-
-                matching_products.append(product_with_deal)
-
-        # Sort by negotiated price (best deals first)
-        matching_products.sort(key=lambda x: x['negotiated_price'])
-
-        return matching_products
+        # Affordable products with their AI-negotiated (15% off) prices, best
+        # deals first; the deal dicts are built only for the ones displayed
+        return self.catalog.find(intent['product'], intent['budget'])
 
     def display_products(self, products, intent):
         """Display found products"""
         if not products:
             print(f"😔 No {intent['product']} found within ₹{intent['budget']} budget.")
-            self.speak(f"Sorry, I couldn't find any {intent['product']} within your budget of ₹{intent['budget']}. Would you like me to increase the budget or look for alternatives?")
+            self.speak(f"Sorry, I couldn't find any {intent['product']} within your budget of ₹{intent['budget']}. Would you like me to increase the budget or look for alternatives?",
+                       HIGH, interrupt=True)
             return
 
         print(f"\n🎉 Found {len(products)} Great Deals!")
-        print(f"💰 AI-negotiated prices with 15% discount!")
+        print(f"💰 AI-negotiated prices with {DISCOUNT_PERCENT}% discount!")
         print("=" * 60)
 
-        total_savings = 0
+        top_products = products[:3]  # Show top 3
 
-        for i, product in enumerate(products[:3], 1):  # Show top 3
+        for i, product in enumerate(top_products, 1):
             print(f"\n{i}. {product['name']}")
             print(f"   Store: {product['store']}")
             print(f"   Original: ₹{product['original_price']:,}")
@@ -246,7 +191,7 @@ class WhisperCartAI:
             print(f"   You Save: ₹{product['savings']:,} ({product['discount_percent']}%)")
             print(f"   Rating: {'⭐' * int(product['rating'])} {product['rating']}")
 
-        total_savings = sum(p['savings'] for p in products[:3])
+        total_savings = sum(p['savings'] for p in top_products)
         self.stats['total_savings'] += total_savings
         self.stats['total_searches'] += 1
         self.stats['voice_searches'] += 1
@@ -254,8 +199,9 @@ class WhisperCartAI:
         print(f"\n💸 Total Potential Savings: ₹{total_savings:,}")
         print(f"📊 Stats: {self.stats['total_searches']} searches, ₹{self.stats['total_savings']:,} saved")
 
-        # Speak results
-        self.speak(f"I found {len(products)} great deals for {intent['product']}! You could save up to ₹{total_savings:,} with AI-negotiated prices.")
+        # Speak results; they make the "processing" announcements stale
+        self.speak(f"I found {len(products)} great deals for {intent['product']}! You could save up to ₹{total_savings:,} with AI-negotiated prices.",
+                   HIGH, interrupt=True)
 
     def run(self):
         """Main application loop"""
@@ -263,6 +209,8 @@ class WhisperCartAI:
 
         while True:
             try:
+                self.speech.begin_interaction()
+
                 # Listen for voice input
                 text = self.listen()
 
@@ -271,7 +219,7 @@ class WhisperCartAI:
 
                 # Check for exit commands
                 if 'exit' in text or 'quit' in text or 'bye' in text:
-                    self.speak("Thank you for using WhisperCart! Happy shopping!")
+                    self.speak("Thank you for using WhisperCart! Happy shopping!", HIGH, interrupt=True)
                     print("👋 Goodbye!")
                     break
 
@@ -292,27 +240,32 @@ class WhisperCartAI:
 
             except KeyboardInterrupt:
                 print("\n👋 Goodbye!")
-                self.speak("Goodbye! Happy shopping with WhisperCart!")
+                self.speak("Goodbye! Happy shopping with WhisperCart!", HIGH, interrupt=True)
                 break
             except Exception as e:
                 print(f"❌ Error: {e}")
-                self.speak("Sorry, there was an error. Let's try again.")
+                self.speak("Sorry, there was an error. Let's try again.", HIGH)
+
+        self.shutdown()
 
 def main():
     print("🎉 Starting WhisperCart AI...")
-    print("📦 Installing dependencies if needed...")
 
-    try:
-        # Try to import required libraries
-        import pyttsx3
-    except ImportError:
-        print("❌ Missing dependencies. Installing...")
-        os.system("pip install pyttsx3")
-        print("✅ Dependencies installed! Please restart the script.")
-        return
+    # WHISPERCART_TTS=0 runs headless, without speech
+    tts = os.getenv('WHISPERCART_TTS', '1') != '0'
+    if tts:
+        print("📦 Installing dependencies if needed...")
+        try:
+            # Try to import required libraries
+            import pyttsx3
+        except ImportError:
+            print("❌ Missing dependencies. Installing...")
+            os.system("pip install pyttsx3")
+            print("✅ Dependencies installed! Please restart the script.")
+            return
 
     # Create and run the AI assistant
-    assistant = WhisperCartAI()
+    assistant = WhisperCartAI(tts=tts)
     assistant.run()
 
 if __name__ == "__main__":
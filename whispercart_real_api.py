@@ -14,7 +14,8 @@ import hashlib
 import base64
 from datetime import datetime
 from urllib.parse import urlencode, quote
-import re
+
+from intent_engine import analyze_intent
 
 class RealEcommerceAPI:
     """Real e-commerce API integrations"""
@@ -198,36 +199,7 @@ class WhisperCartRealAPI:
         print(f"\n🎤 You said: '{text}'")
         print("🤖 AI processing with real APIs...")
 
-        text = text.lower()
-        category = 'running shoes'
-        budget = 3000
-
-        # Enhanced category detection
-        if any(word in text for word in ['headphone', 'earphone', 'earbuds', 'audio']):
-            category = 'headphones'
-        elif any(word in text for word in ['smartphone', 'phone', 'mobile', 'android', 'iphone']):
-            category = 'smartphones'
-        elif any(word in text for word in ['laptop', 'computer', 'notebook']):
-            category = 'laptops'
-        elif any(word in text for word in ['watch', 'smartwatch']):
-            category = 'watches'
-        elif any(word in text for word in ['shoe', 'sneaker', 'running']):
-            category = 'running shoes'
-
-        # Extract budget with multiple patterns
-        budget_patterns = [
-            r'under\s+(\d+)',
-            r'within\s+(\d+)',
-            r'below\s+(\d+)',
-            r'(\d+)\s+rupees?',
-            r'₹?\s*(\d+)'
-        ]
-
-        for pattern in budget_patterns:
-            match = re.search(pattern, text)
-            if match:
-                budget = int(match.group(1))
-                break
+        category, budget, _ = analyze_intent(text)
 
         print(f"🎯 AI understood: {category} under ₹{budget}")
         return category, budget